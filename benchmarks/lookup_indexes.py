@@ -0,0 +1,181 @@
+"""Measures the latency of the app's hot lookups against synthetic data, with and without the lookup indexes.
+
+Run from the root of the repo, against a database the configured user can create schemas in (such as with
+SQL_USE_ALEMBIC_USER=yes):
+
+    python3 -m benchmarks.lookup_indexes [titles ...]
+
+Each scale, 10,000, 100,000 and 1,000,000 titles by default, is loaded into a scratch title_benchmark schema which is
+dropped afterwards. Every title has its own address, two restrictions and two charges, one of them attached to a
+restriction, and every owner has ten titles.
+"""
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import text
+
+from title_api.extensions import db
+from title_api.main import app
+
+schema = 'title_benchmark'
+default_scales = [10000, 100000, 1000000]
+titles_per_owner = 10
+runs_per_query = 200
+titles_per_batch = 10
+
+# The tables as they are after all of the migrations before the lookup indexes
+tables = [
+    """CREATE TABLE address (address_id integer PRIMARY KEY, house_name_or_number varchar NOT NULL,
+        street_name varchar NOT NULL, city varchar NOT NULL, county varchar NOT NULL, country varchar NOT NULL,
+        postcode varchar NOT NULL)""",
+    """CREATE TABLE owner (identity varchar PRIMARY KEY, forename varchar NOT NULL, surname varchar NOT NULL,
+        email varchar NOT NULL, phone varchar NOT NULL, owner_type varchar NOT NULL,
+        address_id integer NOT NULL REFERENCES address (address_id))""",
+    "CREATE UNIQUE INDEX ix_owner_email ON owner (email)",
+    """CREATE TABLE title (title_number varchar PRIMARY KEY, created_at timestamp NOT NULL DEFAULT now(),
+        updated_at timestamp, lock timestamp, owner_identity varchar NOT NULL,
+        address_id integer NOT NULL REFERENCES address (address_id), document varchar)""",
+    """CREATE TABLE charge (charge_id integer PRIMARY KEY, charge_date timestamp NOT NULL DEFAULT now(),
+        charge_lender varchar NOT NULL, charge_amount double precision NOT NULL,
+        charge_currency_type varchar NOT NULL, title_number varchar REFERENCES title (title_number))""",
+    """CREATE TABLE restriction (restriction_id integer PRIMARY KEY, restriction_code varchar NOT NULL,
+        restriction_type varchar NOT NULL, restriction_text varchar NOT NULL, consenting_party varchar NOT NULL,
+        restriction_date timestamp NOT NULL DEFAULT now(), title_number varchar REFERENCES title (title_number),
+        charge_id integer REFERENCES charge (charge_id))"""
+]
+
+# The indexes added by the 005_lookup_indexes migration
+indexes = [
+    "CREATE INDEX ix_title_owner_identity ON title (owner_identity)",
+    "CREATE INDEX ix_title_address_id ON title (address_id)",
+    "CREATE INDEX ix_restriction_title_number ON restriction (title_number)",
+    "CREATE INDEX ix_restriction_charge_id ON restriction (charge_id)",
+    "CREATE INDEX ix_charge_title_number ON charge (title_number)",
+    "CREATE INDEX ix_address_postcode_house_name_or_number ON address (postcode, house_name_or_number)"
+]
+
+synthetic_data = [
+    """INSERT INTO address
+        SELECT i, (i % 100)::text, 'Digital Street', 'Bristol', 'Avon', 'England', 'BS' || (i / 100) || ' 8EN'
+        FROM generate_series(1, :titles + :owners) AS i""",
+    """INSERT INTO owner
+        SELECT i::text, 'Lisa', 'White', 'owner' || i || '@example.com', '07123456780', 'individual', :titles + i
+        FROM generate_series(1, :owners) AS i""",
+    """INSERT INTO title (title_number, owner_identity, address_id)
+        SELECT 'BMK' || i, ((i - 1) / :titles_per_owner + 1)::text, i
+        FROM generate_series(1, :titles) AS i""",
+    """INSERT INTO charge
+        SELECT i, now(), 'O=Lender1,L=Plymouth,C=GB', 100000, 'GBP', 'BMK' || ((i - 1) / 2 + 1)
+        FROM generate_series(1, 2 * :titles) AS i""",
+    """INSERT INTO restriction
+        SELECT i, 'RTV', 'ORES', 'Restriction text', 'O=Conveyancer1,L=Plymouth,C=GB', now(),
+               'BMK' || ((i - 1) / 2 + 1), CASE WHEN i % 2 = 1 THEN i END
+        FROM generate_series(1, 2 * :titles) AS i"""
+]
+
+# The statements the title routes issue, by what they are for
+queries = [
+    ("titles by owner identity",
+     """SELECT title.title_number FROM title JOIN owner ON owner.identity = title.owner_identity
+        WHERE owner.identity = :identity""",
+     lambda titles: {"identity": str(random.randint(1, owner_count(titles)))}),
+    ("titles by owner email and address",
+     """SELECT title.title_number FROM title JOIN owner ON owner.identity = title.owner_identity
+        JOIN address ON address.address_id = title.address_id
+        WHERE owner.email = :email AND address.postcode = :postcode AND address.house_name_or_number = :house""",
+     lambda titles: address_parameters(random.randint(1, titles),
+                                       email='owner{}@example.com'.format(random.randint(1, owner_count(titles))))),
+    ("address by postcode and house",
+     "SELECT address_id FROM address WHERE postcode = :postcode AND house_name_or_number = :house",
+     lambda titles: address_parameters(random.randint(1, titles))),
+    ("titles by address",
+     "SELECT title_number FROM title WHERE address_id = :address_id",
+     lambda titles: {"address_id": random.randint(1, titles)}),
+    ("restrictions of titles",
+     "SELECT * FROM restriction WHERE title_number IN :title_numbers",
+     lambda titles: {"title_numbers": random_title_numbers(titles)}),
+    ("charges of titles, with their restriction",
+     """SELECT * FROM charge LEFT OUTER JOIN restriction ON restriction.charge_id = charge.charge_id
+        WHERE charge.title_number IN :title_numbers""",
+     lambda titles: {"title_numbers": random_title_numbers(titles)})
+]
+
+
+def owner_count(titles):
+    return max(titles // titles_per_owner, 1)
+
+
+def address_parameters(address_id, **parameters):
+    parameters.update(postcode='BS{} 8EN'.format(address_id // 100), house=str(address_id % 100))
+    return parameters
+
+
+def random_title_numbers(titles):
+    """A batch of title numbers, as fetched by one SELECT ... IN of a collection."""
+    return tuple('BMK{}'.format(random.randint(1, titles)) for _ in range(titles_per_batch))
+
+
+def time_queries(connection, titles):
+    """Median and 95th percentile latency, in milliseconds, of each query."""
+    results = []
+    for _, statement, parameters in queries:
+        statement = text(statement)
+        latencies = []
+        for _ in range(runs_per_query):
+            start = time.perf_counter()
+            connection.execute(statement, parameters(titles)).fetchall()
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+        results.append((statistics.median(latencies), latencies[int(len(latencies) * 0.95)]))
+    return results
+
+
+def benchmark(connection, titles):
+    """Load the synthetic data at the given scale and time the queries before and after indexing it."""
+    connection.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}; SET search_path TO {0}'.format(schema))
+    for statement in tables:
+        connection.execute(statement)
+
+    start = time.perf_counter()
+    for statement in synthetic_data:
+        connection.execute(text(statement), titles=titles, owners=owner_count(titles),
+                           titles_per_owner=titles_per_owner)
+    connection.execute('ANALYZE')
+    print("Loaded {:,} titles in {:.1f}s".format(titles, time.perf_counter() - start))
+
+    before = time_queries(connection, titles)
+
+    start = time.perf_counter()
+    for statement in indexes:
+        connection.execute(statement)
+    connection.execute('ANALYZE')
+    print("Built indexes in {:.1f}s".format(time.perf_counter() - start))
+
+    after = time_queries(connection, titles)
+    return before, after
+
+
+def main(scales):
+    results = []
+    with app.app_context():
+        connection = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        try:
+            for titles in scales:
+                results.append((titles, benchmark(connection, titles)))
+        finally:
+            connection.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(schema))
+            connection.close()
+
+    print()
+    row = "{:>10}  {:<42}{:>12}{:>12}{:>12}{:>12}"
+    print(row.format("titles", "query (ms)", "before p50", "before p95", "after p50", "after p95"))
+    for titles, (before, after) in results:
+        for (name, _, _), (before_p50, before_p95), (after_p50, after_p95) in zip(queries, before, after):
+            print(row.format("{:,}".format(titles), name, "{:.3f}".format(before_p50), "{:.3f}".format(before_p95),
+                             "{:.3f}".format(after_p50), "{:.3f}".format(after_p95)))
+
+
+if __name__ == '__main__':
+    main([int(titles) for titles in sys.argv[1:]] or default_scales)
@@ -0,0 +1,131 @@
+"""Checks that GET /v1/titles by owner uses an index scan on title, and measures its latency, against synthetic data.
+
+Run from the root of the repo, against a database the configured user can create schemas in (such as with
+SQL_USE_ALEMBIC_USER=yes):
+
+    python3 -m benchmarks.owner_titles [titles]
+
+The titles, 1,000,000 by default, are loaded into a scratch title_benchmark schema, with the indexes, foreign key and
+version column of migrations 005_lookup_indexes to 007_title_version, which is dropped afterwards. Exits non-zero if
+the planner reads the title table with anything other than an index scan.
+"""
+import json
+import random
+import statistics
+import sys
+import time
+
+from sqlalchemy import event, text
+
+from benchmarks.lookup_indexes import indexes, owner_count, schema, synthetic_data, tables, titles_per_owner
+from title_api.extensions import db
+from title_api.main import app
+
+default_titles = 1000000
+requests_to_time = 200
+
+# What the title schema has on top of the tables lookup_indexes benchmarks
+migrated_schema = [
+    """CREATE TABLE price_history (title_number varchar NOT NULL REFERENCES title (title_number),
+        date timestamp NOT NULL DEFAULT now(), price_amount integer NOT NULL, price_currency varchar NOT NULL,
+        PRIMARY KEY (title_number, date))""",
+    """ALTER TABLE title ADD CONSTRAINT title_owner_identity_fkey FOREIGN KEY (owner_identity)
+        REFERENCES owner (identity)""",
+    "ALTER TABLE title ADD COLUMN version integer NOT NULL DEFAULT 1"
+]
+
+price_history_data = """INSERT INTO price_history
+    SELECT 'BMK' || i, now(), 250000, 'GBP' FROM generate_series(1, :titles) AS i"""
+
+
+def set_search_path(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('SET search_path TO {}'.format(schema))
+    cursor.close()
+
+
+def plan_nodes(plan):
+    """Every node of an EXPLAIN (FORMAT JSON) plan."""
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+
+def title_scans(connection, statement, parameters):
+    """Node type and index of each read of the title table in the plan of the statement."""
+    cursor = connection.connection.cursor()
+    cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + statement, parameters)
+    plan = cursor.fetchone()[0]
+    cursor.close()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return [(node['Node Type'], node.get('Index Name')) for node in plan_nodes(plan[0]['Plan'])
+            if node.get('Relation Name') == 'title']
+
+
+def load(connection, titles):
+    connection.execute('DROP SCHEMA IF EXISTS {0} CASCADE; CREATE SCHEMA {0}'.format(schema))
+    for statement in tables + indexes + migrated_schema:
+        connection.execute(statement)
+
+    start = time.perf_counter()
+    for statement in synthetic_data + [price_history_data]:
+        connection.execute(text(statement), titles=titles, owners=owner_count(titles),
+                           titles_per_owner=titles_per_owner)
+    connection.execute('ANALYZE')
+    print("Loaded {:,} titles in {:.1f}s".format(titles, time.perf_counter() - start))
+
+
+def main(titles):
+    statements = []
+
+    def capture_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    with app.app_context():
+        # Point every connection, including the ones the app makes, at the scratch schema
+        event.listen(db.engine, 'connect', set_search_path)
+        db.engine.dispose()
+        connection = db.engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+        client = app.test_client()
+        try:
+            load(connection, titles)
+
+            # The statement get_titles fetches the titles with is the first one it issues
+            event.listen(db.engine, 'before_cursor_execute', capture_statement)
+            response = client.get('/v1/titles', headers={'accept': 'application/json'},
+                                  query_string={'owner_identity': str(owner_count(titles) // 2)})
+            event.remove(db.engine, 'before_cursor_execute', capture_statement)
+            assert response.status_code == 200 and len(response.json) == titles_per_owner, response.data
+            statement, parameters = statements[0]
+            scans = title_scans(connection, statement, parameters)
+
+            latencies = []
+            for _ in range(requests_to_time):
+                query_string = {'owner_identity': str(random.randint(1, owner_count(titles)))}
+                start = time.perf_counter()
+                client.get('/v1/titles', headers={'accept': 'application/json'}, query_string=query_string)
+                latencies.append((time.perf_counter() - start) * 1000)
+        finally:
+            connection.execute('DROP SCHEMA IF EXISTS {} CASCADE'.format(schema))
+            connection.close()
+            event.remove(db.engine, 'connect', set_search_path)
+            db.engine.dispose()
+
+    latencies.sort()
+    print()
+    print(statement)
+    print("Reads title with: {}".format(', '.join(node_type + (' using ' + index if index else '')
+                                                  for node_type, index in scans)))
+    print("GET /v1/titles?owner_identity= over {} requests: p50 {:.3f}ms, p95 {:.3f}ms".format(
+        requests_to_time, statistics.median(latencies), latencies[int(len(latencies) * 0.95)]))
+
+    if not scans or any(node_type not in ('Index Scan', 'Index Only Scan', 'Bitmap Heap Scan')
+                        for node_type, _ in scans):
+        print("FAIL: title is not read through an index")
+        sys.exit(1)
+    print("PASS: title is read through an index")
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else default_titles)
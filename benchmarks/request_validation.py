@@ -0,0 +1,72 @@
+"""Measures the cost of validating title requests, as each view used to and with the validators built at startup.
+
+Run from the root of the repo, no database is needed:
+
+    python3 -m benchmarks.request_validation [restrictions]
+
+The title request has the given number of restrictions, 10 by default, each with a charge, and as many charges and
+prices again. The bulk request is 100 of those titles.
+"""
+import statistics
+import sys
+import time
+
+from jsonschema import FormatChecker, validate
+
+from title_api.validation import openapi, ref_resolver, validate_request
+
+default_restrictions = 10
+titles_per_bulk_request = 100
+runs = 200
+
+x500 = {"organisation": "Lender1", "locality": "Plymouth", "country": "GB"}
+charge = {"date": "2018-11-07T10:25:29+00:00", "lender": x500, "amount": 150000.5, "amount_currency_code": "GBP"}
+restriction = {"restriction_id": "RTV", "restriction_type": "CBCR", "restriction_text": "Restriction text",
+               "consenting_party": x500, "date": "2018-11-07T10:25:29+00:00", "charge": charge}
+owner = {"identity": "1", "first_name": "Lisa", "last_name": "White", "email_address": "lisa.seller@example.com",
+         "phone_number": "07123456780", "type": "individual",
+         "address": {"house_name_number": "1", "street": "Digital Street", "town_city": "Bristol", "county": "Avon",
+                     "country": "England", "postcode": "BS2 8EN"}}
+
+
+def title_request(restrictions):
+    return {"owner": owner, "charges": [charge] * restrictions, "restrictions": [restriction] * restrictions,
+            "price_history": [{"amount": 100000, "currency_code": "GBP"}] * restrictions}
+
+
+def validate_per_request(name, instance):
+    """Validation as the views did it before the validators were built at startup."""
+    validate(instance, openapi['components']['schemas'][name], format_checker=FormatChecker(), resolver=ref_resolver)
+
+
+def time_validation(validate_instance, name, instance):
+    """Median and 95th percentile time, in milliseconds, to validate the instance."""
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        validate_instance(name, instance)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95)]
+
+
+def main(restrictions):
+    request = title_request(restrictions)
+    requests = [
+        ("TitleRequest", request),
+        ("TitleLookupRequest", {"title_numbers": ["RTV{}".format(100000 + i) for i in range(500)]}),
+        ("TitleBulkRequest", {"titles": [dict(request, title_number="RTV{}".format(100000 + i))
+                                         for i in range(titles_per_bulk_request)]})
+    ]
+
+    row = "{:<20}{:>14}{:>14}{:>14}{:>14}"
+    print(row.format("schema (ms)", "before p50", "before p95", "after p50", "after p95"))
+    for name, instance in requests:
+        before_p50, before_p95 = time_validation(validate_per_request, name, instance)
+        after_p50, after_p95 = time_validation(validate_request, name, instance)
+        print(row.format(name, "{:.3f}".format(before_p50), "{:.3f}".format(before_p95),
+                         "{:.3f}".format(after_p50), "{:.3f}".format(after_p95)))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else default_restrictions)
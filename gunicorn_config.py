@@ -0,0 +1,17 @@
+# Gunicorn hooks, loaded through GUNICORN_CMD_ARGS in the Dockerfile, that keep the metrics directory in step with
+# the workers using it
+import os
+
+from prometheus_client import multiprocess
+
+
+def on_starting(server):
+    """Empty the metrics directory as the app starts, so counts from before a restart aren't added to the new ones."""
+    directory = os.environ['prometheus_multiproc_dir']
+    for name in os.listdir(directory):
+        os.remove(os.path.join(directory, name))
+
+
+def child_exit(server, worker):
+    """Drop a worker's live gauges when it exits, so they are no longer added to those of the other workers."""
+    multiprocess.mark_process_dead(worker.pid)
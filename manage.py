@@ -5,6 +5,7 @@ from title_api.main import app
 # ***** For Alembic start ******
 from flask_migrate import Migrate, MigrateCommand
 from title_api.models import *    # noqa
+from title_api.models import Title
 from title_api.extensions import db
 
 migrate = Migrate(app, db)
@@ -29,5 +30,33 @@ def runserver(port=8005):
     app.run(debug=True, port=int(port))
 
 
+@manager.command
+def rebuild_title_documents(batch_size=500):
+    """Rebuild the stored JSON document of every title"""
+
+    batch_size = int(batch_size)
+    last_title_number = ''
+    rebuilt = 0
+
+    while True:
+        # Walk the titles in primary key order, one batch per transaction
+        titles = Title.query.options(*Title.load_options()) \
+            .filter(Title.title_number > last_title_number) \
+            .order_by(Title.title_number) \
+            .limit(batch_size).all()
+        if not titles:
+            break
+
+        for title in titles:
+            title.build_document()
+        last_title_number = titles[-1].title_number
+        rebuilt += len(titles)
+
+        db.session.commit()
+        db.session.expunge_all()
+
+    print("Rebuilt {} title documents".format(rebuilt))
+
+
 if __name__ == "__main__":
     manager.run()
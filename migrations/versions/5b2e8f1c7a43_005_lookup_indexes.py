@@ -0,0 +1,40 @@
+"""005_lookup_indexes
+
+Revision ID: 5b2e8f1c7a43
+Revises: 09109b834d31
+Create Date: 2026-10-18 16:40:52.118204
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2e8f1c7a43'
+down_revision = '09109b834d31'
+branch_labels = None
+depends_on = None
+
+# Index name, table and columns of every index this revision adds
+indexes = [
+    ('ix_title_owner_identity', 'title', ['owner_identity']),
+    ('ix_title_address_id', 'title', ['address_id']),
+    ('ix_restriction_title_number', 'restriction', ['title_number']),
+    ('ix_restriction_charge_id', 'restriction', ['charge_id']),
+    ('ix_charge_title_number', 'charge', ['title_number']),
+    ('ix_address_postcode_house_name_or_number', 'address', ['postcode', 'house_name_or_number'])
+]
+
+
+def upgrade():
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block, so end the one Alembic has opened. Each index
+    # is then built without blocking writes to its table, so this can be run while the app is live.
+    # If a build fails it leaves an INVALID index behind, which must be dropped before running this again.
+    op.execute('COMMIT')
+    for name, table, columns in indexes:
+        op.create_index(name, table, columns, unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    op.execute('COMMIT')
+    for name, table, columns in reversed(indexes):
+        op.execute('DROP INDEX CONCURRENTLY IF EXISTS "{}"'.format(name))
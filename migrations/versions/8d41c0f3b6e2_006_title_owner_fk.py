@@ -0,0 +1,31 @@
+"""006_title_owner_fk
+
+Revision ID: 8d41c0f3b6e2
+Revises: 5b2e8f1c7a43
+Create Date: 2026-10-18 17:05:37.502916
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d41c0f3b6e2'
+down_revision = '5b2e8f1c7a43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 002_owner_id_type dropped this foreign key, through DROP CONSTRAINT "owner_pkey" CASCADE, without recreating it.
+    # It is added as NOT VALID so only new rows are checked while the table is locked, then the existing rows are
+    # checked in a separate transaction that doesn't block writes. The index that supports it, and owner to titles
+    # lookups, is ix_title_owner_identity from 005_lookup_indexes.
+    # Validating fails if any title belongs to an owner that no longer exists, which have to be fixed first.
+    op.execute('ALTER TABLE "title" ADD CONSTRAINT "title_owner_identity_fkey" FOREIGN KEY ("owner_identity") '
+               'REFERENCES "owner" ("identity") NOT VALID')
+    op.execute('COMMIT')
+    op.execute('ALTER TABLE "title" VALIDATE CONSTRAINT "title_owner_identity_fkey"')
+
+
+def downgrade():
+    op.drop_constraint('title_owner_identity_fkey', 'title', type_='foreignkey')
@@ -0,0 +1,62 @@
+import hashlib
+
+from flask import Response, request
+
+
+def content_etag(content):
+    """Strong ETag of a serialized response body."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha1(content).hexdigest()
+
+
+def model_etag(*instances):
+    """Strong ETag of the column values of the given model instances.
+
+    This lets a view answer a conditional GET from the rows it has loaded, without serializing them.
+    """
+    digest = hashlib.sha1()
+    for instance in instances:
+        for column in instance.__table__.columns:
+            digest.update(repr(getattr(instance, column.key)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def version_etag(version, fields=None):
+    """Strong ETag of a row from its version counter, which changes whenever the row does.
+
+    A representation of only some of the row's fields has an ETag of its own for each set of fields.
+    """
+    if fields is None:
+        return str(version)
+    return '{}-{}'.format(version, content_etag(','.join(sorted(set(fields)))))
+
+
+def versions_etag(versions, fields=None, next_cursor=None):
+    """Strong ETag of a page of rows from their primary keys and version counters, in order.
+
+    fields is the subset of the rows' fields represented, if not all of them. next_cursor is the cursor of the page
+    after, which changes as rows are added after this page without any of its rows changing.
+    """
+    digest = hashlib.sha1()
+    for key, version in versions:
+        digest.update('{}:{};'.format(key, version).encode('utf-8'))
+    if fields is not None:
+        digest.update('fields={};'.format(','.join(sorted(set(fields)))).encode('utf-8'))
+    if next_cursor is not None:
+        digest.update('next={};'.format(next_cursor).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def precondition_failed(etag):
+    """Whether the request has an If-Match that the etag doesn't satisfy. If-Match: * is satisfied by any etag."""
+    return bool(request.if_match) and not request.if_match.contains(etag)
+
+
+def not_modified(etag):
+    """Return a 304 response if the request's If-None-Match matches the etag, otherwise None."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
@@ -27,10 +27,39 @@ else:
 SQLALCHEMY_DATABASE_URI = 'postgres://{0}:{1}@{2}/{3}'.format(FINAL_SQL_USERNAME, SQL_PASSWORD, SQL_HOST, SQL_DATABASE)
 SQLALCHEMY_TRACK_MODIFICATIONS = False  # Explicitly set this in order to remove warning on run
 SQLALCHEMY_POOL_RECYCLE = int(os.environ['SQLALCHEMY_POOL_RECYCLE'])
+# Seconds a new connection to the database waits to connect before giving up
+SQL_CONNECT_TIMEOUT = int(os.environ['SQL_CONNECT_TIMEOUT'])
 
 
 # For the enhanced logging extension
 FLASK_LOG_LEVEL = os.environ['LOG_LEVEL']
+# How many log records can be waiting to be written before more are dropped
+LOG_QUEUE_SIZE = int(os.environ['LOG_QUEUE_SIZE'])
+
+# Whether requests to these blueprints report how long they spent on each phase, in a Server-Timing header and the log
+SERVER_TIMING = os.environ['SERVER_TIMING'] == 'yes'
+SERVER_TIMING_BLUEPRINTS = ['title_v1', 'owner_v1', 'conveyancer_v1']
+
+# SQL statements that take SQL_SLOW_STATEMENT_SECONDS or longer are logged with the trace id of the request that ran
+# them. Requests to these endpoints that run more statements than their budget are logged too, or fail, with
+# SQL_STATEMENT_BUDGET_STRICT, so a change that makes an endpoint run more statements fails its tests. Updates aren't
+# budgeted, as what they write, and which other titles' documents they rebuild, depends on what they change.
+SQL_SLOW_STATEMENT_SECONDS = float(os.environ['SQL_SLOW_STATEMENT_SECONDS'])
+SQL_STATEMENT_BUDGET_STRICT = os.environ['SQL_STATEMENT_BUDGET_STRICT'] == 'yes'
+SQL_STATEMENT_BUDGETS = {
+    'title_v1.get_titles': 5,
+    'title_v1.get_title': 5,
+    'title_v1.lookup_titles': 5,
+    'title_v1.lock_title': 7,
+    'title_v1.unlock_title': 7,
+    'owner_v1.get_owner': 2,
+    'conveyancer_v1.get_conveyancers': 1,
+    'conveyancer_v1.get_conveyancer': 1
+}
+
+# Directory that each worker keeps its metrics in, so /metrics can add up those of every worker. prometheus_client
+# reads the variable itself, it is named by it. gunicorn_config.py empties the directory whenever the app starts.
+METRICS_MULTIPROC_DIR = os.environ['prometheus_multiproc_dir']
 
 # For health route
 COMMIT = os.environ['COMMIT']
@@ -41,6 +70,23 @@ APP_NAME = os.environ['APP_NAME']
 MAX_HEALTH_CASCADE = int(os.environ['MAX_HEALTH_CASCADE'])
 DEFAULT_TIMEOUT = int(os.environ['DEFAULT_TIMEOUT'])
 
+# Calls to other APIs share a pool of kept-alive connections, up to OUTBOUND_POOL_MAXSIZE to each of
+# OUTBOUND_POOL_CONNECTIONS hosts. Idempotent calls that fail to connect, or get a 502, 503 or 504, are retried
+# OUTBOUND_RETRIES times, with a backoff of OUTBOUND_RETRY_BACKOFF seconds that doubles on each retry. Calls that
+# time out waiting for a response aren't retried.
+OUTBOUND_POOL_CONNECTIONS = int(os.environ['OUTBOUND_POOL_CONNECTIONS'])
+OUTBOUND_POOL_MAXSIZE = int(os.environ['OUTBOUND_POOL_MAXSIZE'])
+OUTBOUND_RETRIES = int(os.environ['OUTBOUND_RETRIES'])
+OUTBOUND_RETRY_BACKOFF = float(os.environ['OUTBOUND_RETRY_BACKOFF'])
+
+# The health cascade checks its dependencies concurrently on a pool of HEALTH_CASCADE_WORKERS threads. Each check is
+# given up on after HEALTH_CASCADE_DEPENDENCY_TIMEOUT seconds, and the whole cascade after HEALTH_CASCADE_TIMEOUT.
+HEALTH_CASCADE_WORKERS = int(os.environ['HEALTH_CASCADE_WORKERS'])
+HEALTH_CASCADE_DEPENDENCY_TIMEOUT = float(os.environ['HEALTH_CASCADE_DEPENDENCY_TIMEOUT'])
+HEALTH_CASCADE_TIMEOUT = float(os.environ['HEALTH_CASCADE_TIMEOUT'])
+# How long the result of the health cascade's database probe is reused for, in seconds
+HEALTH_DATABASE_CACHE_SECONDS = float(os.environ['HEALTH_DATABASE_CACHE_SECONDS'])
+
 # Following is an example of building the dependency structure used by the cascade route
 # SELF can be used to demonstrate how it works (i.e. it will call it's own casecade
 # route until MAX_HEALTH_CASCADE is hit)
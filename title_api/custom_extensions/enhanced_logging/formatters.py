@@ -16,7 +16,11 @@ class JsonFormatter(logging.Formatter):
             [('timestamp', self.formatTime(record)),
              ('level', record.levelname),
              ('traceid', record.trace_id),
-             ('message', record.msg % record.args),
+             ('message', record.getMessage()),
              ('exception', exc)])
 
+        # Timings of the request, on the line logged as it finishes if it was timed
+        if hasattr(record, 'timings'):
+            log_entry['timings'] = record.timings
+
         return json.dumps(log_entry, separators=(',', ':'))
@@ -0,0 +1,73 @@
+import atexit
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+from .formatters import JsonFormatter
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue handler that drops records when the queue is full, rather than make the logging thread wait.
+
+    Records are queued as they are, so formatting them, tracebacks included, is left to the listener's thread. The
+    number dropped is kept in dropped, and reported by a warning queued ahead of the next record that fits.
+    """
+
+    def __init__(self, log_queue):
+        super(DroppingQueueHandler, self).__init__(log_queue)
+        self.dropped = 0
+        self.unreported = 0
+
+    def prepare(self, record):
+        # Merge the arguments into the message now, while anything they refer to is still as it was
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Called with the handler's lock held, so the counts are only changed by one thread at a time
+        try:
+            if self.unreported:
+                self.queue.put_nowait(self.dropped_record(record))
+                self.unreported = 0
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self.unreported += 1
+
+    def dropped_record(self, record):
+        """Warning that records have been dropped since the last one was queued."""
+        return logging.makeLogRecord({
+            'name': record.name,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': "Dropped {} log records as the log queue was full".format(self.unreported),
+            'trace_id': getattr(record, 'trace_id', 'N/A')
+        })
+
+
+class FlushingQueueListener(QueueListener):
+    """Queue listener that waits for room to queue its stop, so every record queued before it is written."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+    def stop(self):
+        if self._thread is not None:
+            super(FlushingQueueListener, self).stop()
+
+
+def queue_handler(maxsize, stream):
+    """Create a handler that queues records for a background thread to write as JSON to the stream.
+
+    The queue holds up to maxsize records. Whatever is left on it is written when the process exits.
+    """
+    handler = DroppingQueueHandler(queue.Queue(maxsize))
+
+    stream_handler = logging.StreamHandler(stream)
+    stream_handler.setFormatter(JsonFormatter())
+
+    handler.listener = FlushingQueueListener(handler.queue, stream_handler, respect_handler_level=True)
+    handler.listener.start()
+    atexit.register(handler.listener.stop)
+    return handler
@@ -1,20 +1,28 @@
 import uuid
 from pathlib import Path
+from threading import Lock
 
 import requests
-from flask import current_app, g, request
+from flask import ctx, current_app, g, request
 from flask_logconfig import LogConfig
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class RequestsSessionTimeout(requests.Session):
-    """Custom requests session class to set some defaults on g.requests"""
+    """Custom requests session class to set some defaults on outbound requests"""
     def request(self, *args, **kwargs):
         # Set a default timeout for the request.
         # Can be overridden in the same way that you would normally set a timeout
-        # i.e. g.requests.get(timeout=5)
+        # i.e. enhanced_logging.requests.get(timeout=5)
         if not kwargs.get('timeout'):
             kwargs['timeout'] = current_app.config['DEFAULT_TIMEOUT']
 
+        # The session is shared by every request the worker handles, so the trace id of the one making this call is
+        # added now, so other APIs will receive it
+        if ctx.has_app_context() and 'trace_id' in g:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **{'X-Trace-ID': g.trace_id})
+
         return super(RequestsSessionTimeout, self).request(*args, **kwargs)
 
 
@@ -22,19 +30,46 @@ def before_request():
     # Sets the transaction trace id on the global object if provided in the HTTP header from the caller.
     # Generate a new one if it has not. We will use this in log messages.
     g.trace_id = request.headers.get('X-Trace-ID', uuid.uuid4().hex)
-    # We also create a session-level requests object for the app to use with the header pre-set, so other APIs
-    # will receive it. These lines can be removed if the app will not make requests to other LR APIs!
-    g.requests = RequestsSessionTimeout()
-    g.requests.headers.update({'X-Trace-ID': g.trace_id})
+
+
+def create_requests_session(config):
+    """Create a requests session whose connections to each host are pooled and kept alive between calls.
+
+    Idempotent calls that fail to connect, or get a 502, 503 or 504, are retried with a backoff. Calls that time out
+    waiting for a response aren't, so waiting on a hung service takes one timeout rather than one per attempt. The
+    backoff is always our own, rather than a Retry-After the service asks for, so callers know how long it can take.
+    """
+    session = RequestsSessionTimeout()
+    retries = Retry(total=config['OUTBOUND_RETRIES'], read=0, backoff_factor=config['OUTBOUND_RETRY_BACKOFF'],
+                    status_forcelist=(502, 503, 504), raise_on_status=False, respect_retry_after_header=False)
+    adapter = HTTPAdapter(pool_connections=config['OUTBOUND_POOL_CONNECTIONS'],
+                          pool_maxsize=config['OUTBOUND_POOL_MAXSIZE'], max_retries=retries)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
 
 class EnhancedLogging(object):
 
     def __init__(self, app=None):
         self.app = app
+        self._requests = None
+        self._requests_lock = Lock()
         if app is not None:
             self.init_app(app)
 
+    @property
+    def requests(self):
+        """Requests session for calls to other APIs, shared by all of the worker's threads.
+
+        It is only created when the first call is made, so workers that never make one don't have it.
+        """
+        if self._requests is None:
+            with self._requests_lock:
+                if self._requests is None:
+                    self._requests = create_requests_session(current_app.config)
+        return self._requests
+
     def init_app(self, app):
         # Ensure that the traceid is parsed/propagated on every request
         app.before_request(before_request)
@@ -56,10 +91,12 @@ class EnhancedLogging(object):
                 }
             },
             'handlers': {
+                # Records are put on a bounded queue, and formatted and written to stdout by a background thread,
+                # so a slow log collector doesn't hold up requests
                 'console': {
-                    'class': 'logging.StreamHandler',
-                    'formatter': 'simple',
+                    '()': app_module_name + '.custom_extensions.enhanced_logging.handlers.queue_handler',
                     'filters': ['contextual'],
+                    'maxsize': app.config['LOG_QUEUE_SIZE'],
                     'stream': 'ext://sys.stdout'
                 }
             },
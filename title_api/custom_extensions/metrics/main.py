@@ -0,0 +1,137 @@
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+
+from flask import current_app, g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from sqlalchemy.pool import QueuePool
+
+# Metrics are kept per worker process. With the prometheus_multiproc_dir environment variable set, prometheus_client
+# keeps them in files in that directory, and /metrics adds up those of every worker.
+http_requests = Counter('title_api_http_requests_total', "HTTP requests handled, by route and status code",
+                        ['blueprint', 'route', 'method', 'status'])
+http_request_duration = Histogram('title_api_http_request_duration_seconds',
+                                  "Time taken to handle HTTP requests, by route and status code",
+                                  ['blueprint', 'route', 'method', 'status'])
+pool_checkouts = Counter('title_api_db_pool_checkouts_total', "Connections checked out of the SQLAlchemy pool")
+pool_wait = Histogram('title_api_db_pool_wait_seconds', "Time spent waiting for a connection from the SQLAlchemy pool",
+                      buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30))
+pool_checked_out = Gauge('title_api_db_pool_checked_out', "Connections currently checked out of the SQLAlchemy pool",
+                         multiprocess_mode='livesum')
+pool_overflow = Gauge('title_api_db_pool_overflow', "Connections currently open beyond the SQLAlchemy pool's size",
+                      multiprocess_mode='livesum')
+title_locks = Counter('title_api_title_locks_total', "Title lock and unlock requests, by outcome",
+                      ['action', 'outcome'])
+sql_statements = Histogram('title_api_sql_statements', "SQL statements run by each HTTP request, by route",
+                           ['blueprint', 'route', 'method'], buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+sql_statement_duration = Histogram('title_api_sql_statement_duration_seconds',
+                                   "Time each HTTP request spent running SQL statements, by route",
+                                   ['blueprint', 'route', 'method'])
+cache_lookups = Counter('title_api_cache_lookups_total', "Cache lookups, by cache and whether they hit",
+                        ['cache', 'result'])
+
+# Outcome of a lock or unlock by the status code it responds with
+lock_outcomes = {200: 'ok', 404: 'not_found', 409: 'conflict'}
+
+# lru_cache functions whose hits and misses are counted, by cache name, with the counts last recorded
+lru_caches = {}
+lru_caches_lock = Lock()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records its checkouts, how long they wait for a connection, and how many are in use."""
+
+    def _do_get(self):
+        started = perf_counter()
+        connection = super(MeteredQueuePool, self)._do_get()
+        pool_wait.observe(perf_counter() - started)
+        pool_checkouts.inc()
+        self._record_usage()
+        return connection
+
+    def _do_return_conn(self, conn):
+        super(MeteredQueuePool, self)._do_return_conn(conn)
+        self._record_usage()
+
+    def _record_usage(self):
+        pool_checked_out.set(self.checkedout())
+        pool_overflow.set(max(self.overflow(), 0))
+
+
+def record_cache_lookups(cache, hits=0, misses=0):
+    """Count lookups of a cache that hit and missed."""
+    if hits:
+        cache_lookups.labels(cache, 'hit').inc(hits)
+    if misses:
+        cache_lookups.labels(cache, 'miss').inc(misses)
+
+
+def count_lru_cache(cache, function):
+    """Count the hits and misses of an lru_cache function as lookups of the named cache, as requests finish."""
+    lru_caches[cache] = (function, function.cache_info())
+
+
+def record_lru_caches():
+    with lru_caches_lock:
+        for cache, (function, recorded) in lru_caches.items():
+            info = function.cache_info()
+            record_cache_lookups(cache, max(info.hits - recorded.hits, 0), max(info.misses - recorded.misses, 0))
+            lru_caches[cache] = (function, info)
+
+
+def counts_lock_outcome(action):
+    """Decorator for the lock and unlock views that counts what each request to them came to."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                response = view(*args, **kwargs)
+            except Exception as e:
+                title_locks.labels(action, lock_outcomes.get(getattr(e, 'http_code', 500), 'error')).inc()
+                raise
+            title_locks.labels(action, lock_outcomes.get(response.status_code, 'error')).inc()
+            return response
+        return wrapper
+    return decorator
+
+
+def route_labels():
+    """Blueprint, route and method of the request being handled, as metrics are labelled with."""
+    return (request.blueprint or '', request.url_rule.rule if request.url_rule else 'unmatched', request.method)
+
+
+def before_request():
+    g.metrics_started = perf_counter()
+
+
+def after_request(response):
+    started = g.pop('metrics_started', None)
+    if started is not None:
+        labels = route_labels() + (str(response.status_code),)
+        http_requests.labels(*labels).inc()
+        http_request_duration.labels(*labels).observe(perf_counter() - started)
+    record_lru_caches()
+    return response
+
+
+def latest():
+    """The metrics of every worker in Prometheus' text format, or of this one if they aren't kept in files."""
+    if current_app.config['METRICS_MULTIPROC_DIR']:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+class Metrics(object):
+    """Collects the metrics served in Prometheus' text format by /metrics."""
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(before_request)
+        app.after_request(after_request)
@@ -0,0 +1,133 @@
+from collections import OrderedDict
+from functools import wraps
+from time import perf_counter
+
+from flask import ctx, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Set from the SERVER_TIMING config when the extension is added to the app. While it is off, the timed functions go
+# straight through to the function they wrap, and the hooks return straight away.
+enabled = False
+
+# The phases a request is broken down into, in the order they are reported
+phases = ['validation', 'sql', 'serialize', 'encode']
+
+
+class RequestTimings(object):
+    """Time spent in each phase of the request being handled.
+
+    A phase that is entered again before it is left, such as one as_dict calling another, is only counted once.
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.durations = {}
+        self.active = {}
+
+    def start(self, phase):
+        entered = self.active.get(phase)
+        if entered:
+            entered[0] += 1
+        else:
+            self.active[phase] = [1, perf_counter()]
+
+    def stop(self, phase):
+        entered = self.active[phase]
+        entered[0] -= 1
+        if not entered[0]:
+            del self.active[phase]
+            self.durations[phase] = self.durations.get(phase, 0) + perf_counter() - entered[1]
+
+    def milliseconds(self):
+        """Time spent in each phase that was entered, and in the whole request so far, in milliseconds."""
+        result = OrderedDict((phase, round(self.durations[phase] * 1000, 2))
+                             for phase in phases if phase in self.durations)
+        result['total'] = round((perf_counter() - self.started) * 1000, 2)
+        return result
+
+
+def request_timings():
+    """The timings of the request being handled, or None if it isn't being timed."""
+    if not ctx.has_app_context():
+        return None
+    return g.get('server_timing')
+
+
+def timed(phase):
+    """Decorator that adds the time spent in the function to a phase of the request being handled."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            timings = request_timings()
+            if timings is None:
+                return function(*args, **kwargs)
+            timings.start(phase)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timings.stop(phase)
+        return wrapper
+    return decorator
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = request_timings() if enabled else None
+    if timings is not None:
+        timings.start('sql')
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = request_timings() if enabled else None
+    if timings is not None:
+        timings.stop('sql')
+
+
+def handle_error(exception_context):
+    # A failed statement doesn't reach after_cursor_execute, so it is stopped here
+    timings = request_timings() if enabled else None
+    if timings is not None and 'sql' in timings.active:
+        timings.stop('sql')
+
+
+def before_request():
+    if enabled and request.blueprint in current_app.config['SERVER_TIMING_BLUEPRINTS']:
+        g.server_timing = RequestTimings()
+
+
+def after_request(response):
+    timings = g.pop('server_timing', None)
+    if timings is None:
+        return response
+
+    # Streamed responses are still to be generated, so only the work done before they start is included
+    milliseconds = timings.milliseconds()
+    response.headers['Server-Timing'] = ', '.join('{};dur={}'.format(phase, duration)
+                                                  for phase, duration in milliseconds.items())
+    current_app.logger.info("Timings of {} {}".format(request.method, request.path),
+                            extra={'timings': milliseconds})
+    return response
+
+
+class ServerTiming(object):
+    """Times the validation, SQL, as_dict serialization and JSON encoding of each request to the chosen blueprints.
+
+    The timings are returned in a Server-Timing header, and logged with the request's trace id.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        global enabled
+        enabled = app.config['SERVER_TIMING']
+
+        app.before_request(before_request)
+        app.after_request(after_request)
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+        event.listen(Engine, 'handle_error', handle_error)
@@ -0,0 +1,98 @@
+import re
+from time import perf_counter
+
+from flask import ctx, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from title_api.custom_extensions.metrics.main import route_labels, sql_statement_duration, sql_statements
+
+
+class StatementBudgetExceeded(AssertionError):
+    """Raised when a request runs more SQL statements than its route's budget allows, while budgets are strict."""
+
+
+class RequestStatements(object):
+    """Number of SQL statements the request being handled has run, and the time they took."""
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.count = 0
+        self.duration = 0
+
+
+def request_statements():
+    """The statements of the request being handled, or None if they aren't being counted."""
+    if not ctx.has_app_context():
+        return None
+    return g.get('sql_statements')
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statements = request_statements()
+    if statements is not None:
+        statements.count += 1
+        if statements.budget is not None and statements.count > statements.budget and \
+                current_app.config['SQL_STATEMENT_BUDGET_STRICT']:
+            raise StatementBudgetExceeded("{} ran more than its budget of {} SQL statements, going over it with: {}"
+                                          .format(request.endpoint, statements.budget, one_line(statement)))
+
+    conn.info['statement_started'] = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # A statement that fails doesn't get here, and its start is replaced by the next one's
+    started = conn.info.pop('statement_started', None)
+    if started is None or not ctx.has_app_context():
+        return
+    duration = perf_counter() - started
+
+    statements = g.get('sql_statements')
+    if statements is not None:
+        statements.duration += duration
+
+    # Only statements run for a request, or a health check, have a trace id to log them with
+    if duration >= current_app.config['SQL_SLOW_STATEMENT_SECONDS'] and 'trace_id' in g:
+        current_app.logger.warning("Slow SQL statement took {:.1f}ms: {}"
+                                   .format(duration * 1000, one_line(statement)))
+
+
+def one_line(statement):
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def before_request():
+    g.sql_statements = RequestStatements(current_app.config['SQL_STATEMENT_BUDGETS'].get(request.endpoint))
+
+
+def after_request(response):
+    statements = g.pop('sql_statements', None)
+    if statements is None:
+        return response
+
+    labels = route_labels()
+    sql_statements.labels(*labels).observe(statements.count)
+    sql_statement_duration.labels(*labels).observe(statements.duration)
+
+    if statements.budget is not None and statements.count > statements.budget:
+        current_app.logger.warning("{} {} ran {} SQL statements, over its budget of {}"
+                                   .format(request.method, request.path, statements.count, statements.budget))
+    return response
+
+
+class SQLStatements(object):
+    """Counts and times the SQL statements each request runs, logging slow ones and requests over their budget.
+
+    Budgets are numbers of statements, by endpoint, in SQL_STATEMENT_BUDGETS. Going over one is logged as a warning,
+    or fails the request with StatementBudgetExceeded if SQL_STATEMENT_BUDGET_STRICT is set, as it is in the tests.
+    """
+
+    def __init__(self, app=None):
+        self.app = app
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.before_request(before_request)
+        app.after_request(after_request)
+        event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
@@ -1,20 +1,71 @@
+from threading import Lock
+import time
+
 from flask import current_app
-import psycopg2
+from sqlalchemy import exc
+from title_api.custom_extensions.metrics.main import record_cache_lookups
 from title_api.exceptions import ApplicationError
+from title_api.extensions import db
+
+# Expiry, timestamp and error of the last probe of the database, replaced as a whole so threads never see a mix
+last_probe = (0, None, None)
+probe_lock = Lock()
 
 
 def get_current_timestamp():
+    """Get the database's current timestamp, through the app's connection pool.
+
+    A probe's result, or its error, is reused for HEALTH_DATABASE_CACHE_SECONDS. When it expires only one thread
+    probes the database again, and any others wait for its result, so a burst of health checks costs one query. They
+    only wait for HEALTH_CASCADE_DEPENDENCY_TIMEOUT, so a hung database can't hold up every health check behind it.
+    """
+    global last_probe
+    probed = False
+    if time.monotonic() >= last_probe[0]:
+        if not probe_lock.acquire(timeout=current_app.config['HEALTH_CASCADE_DEPENDENCY_TIMEOUT']):
+            record_cache_lookups('health_database', misses=1)
+            raise ApplicationError('Database error: timed out waiting for the database probe', 'DB', http_code=400)
+        try:
+            # Another thread may have probed while this one waited for the lock
+            if time.monotonic() >= last_probe[0]:
+                timestamp, error = probe()
+                last_probe = (time.monotonic() + current_app.config['HEALTH_DATABASE_CACHE_SECONDS'], timestamp, error)
+                probed = True
+        finally:
+            probe_lock.release()
+    record_cache_lookups('health_database', hits=int(not probed), misses=int(probed))
+
+    _, timestamp, error = last_probe
+    if error is not None:
+        raise ApplicationError(error.message, error.code, http_code=error.http_code)
+    return timestamp
+
+
+def probe():
+    """Read the database's current timestamp on a pooled connection, returning it or the error it failed with.
+
+    On PostgreSQL the query is cancelled after HEALTH_CASCADE_DEPENDENCY_TIMEOUT, and connecting is bounded by the
+    engine's SQL_CONNECT_TIMEOUT.
+    """
     try:
-        conn = psycopg2.connect(current_app.config['SQLALCHEMY_DATABASE_URI'])
-        cur = conn.cursor()
-        cur.execute("SELECT CURRENT_TIMESTAMP;")
-        result = cur.fetchone()
-        cur.close()
-        conn.close()
-        return result[0]
-    except psycopg2.DataError as e:
-        raise ApplicationError(
-            'Input data error: ' + str(e), 'DB', http_code=400)
-    except (psycopg2.OperationalError, psycopg2.ProgrammingError) as e:
-        raise ApplicationError(
-            'Database error: ' + str(e), 'DB', http_code=400)
+        with db.engine.connect() as connection, connection.begin():
+            if connection.dialect.name == 'postgresql':
+                timeout = int(current_app.config['HEALTH_CASCADE_DEPENDENCY_TIMEOUT'] * 1000)
+                connection.execute("SET LOCAL statement_timeout = {:d}".format(timeout))
+            return connection.execute("SELECT CURRENT_TIMESTAMP;").scalar(), None
+    except exc.DataError as e:
+        return None, ApplicationError('Input data error: ' + str(e), 'DB', http_code=400)
+    except (exc.OperationalError, exc.ProgrammingError, exc.TimeoutError) as e:
+        return None, ApplicationError('Database error: ' + str(e), 'DB', http_code=400)
+
+
+def get_pool_status():
+    """Size and usage of the app's connection pool, for pools that keep count of them."""
+    pool = db.engine.pool
+    if not hasattr(pool, 'overflow'):
+        return None
+    return {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0)
+    }
@@ -1,9 +1,10 @@
-import json
 import traceback
 
-from flask import Response, current_app
+from flask import current_app
 from werkzeug.exceptions import NotFound, NotAcceptable
 
+from title_api.responses import json_object_response
+
 
 class ApplicationError(Exception):
     """Use this class when the application identifies there's been a problem and the client should be informed.
@@ -41,14 +42,14 @@ def not_found_error(e):
     response_dict = {
         "error_message": "Not Found", "error_code": "404"}
 
-    return Response(response=json.dumps(response_dict, separators=(',', ':')), mimetype='application/json', status=404)
+    return json_object_response(response_dict, 404, sort_keys=False)
 
 
 def not_acceptable_error(e):
     response_dict = {
         "error_message": "Not Acceptable", "error_code": "406"}
 
-    return Response(response=json.dumps(response_dict, separators=(',', ':')), mimetype='application/json', status=406)
+    return json_object_response(response_dict, 406, sort_keys=False)
 
 
 def unhandled_exception(e):
@@ -68,7 +69,7 @@ def unhandled_exception(e):
     if current_app.config.get('FLASK_LOG_LEVEL', 'INFO').upper() == 'DEBUG':
         response_dict['stacktrace'] = traceback.format_exc()
 
-    return Response(response=json.dumps(response_dict, separators=(',', ':')), mimetype='application/json', status=500)
+    return json_object_response(response_dict, 500, sort_keys=False)
 
 
 def application_error(e):
@@ -94,8 +95,7 @@ def application_error(e):
     if current_app.config.get('FLASK_LOG_LEVEL', 'INFO').upper() == 'DEBUG':
         response_dict['stacktrace'] = traceback.format_exc()
 
-    return Response(response=json.dumps(response_dict, separators=(',', ':')),
-                    mimetype='application/json', status=e.http_code)
+    return json_object_response(response_dict, e.http_code, sort_keys=False)
 
 
 def register_exception_handlers(app):
@@ -1,9 +1,29 @@
 from flask_sqlalchemy import SQLAlchemy
 from title_api.custom_extensions.enhanced_logging.main import EnhancedLogging
+from title_api.custom_extensions.metrics.main import MeteredQueuePool, Metrics
+from title_api.custom_extensions.server_timing.main import ServerTiming
+from title_api.custom_extensions.sql_statements.main import SQLStatements
+
+
+class MeteredSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose PostgreSQL engine's connection pool records its metrics.
+
+    Its connections give up connecting after SQL_CONNECT_TIMEOUT seconds, rather than waiting on a hung database.
+    """
+
+    def apply_driver_hacks(self, app, info, options):
+        if info.drivername.startswith('postgres'):
+            options.setdefault('poolclass', MeteredQueuePool)
+            options.setdefault('connect_args', {}).setdefault('connect_timeout', app.config['SQL_CONNECT_TIMEOUT'])
+        return super(MeteredSQLAlchemy, self).apply_driver_hacks(app, info, options)
+
 
 # Create empty extension objects here
 enhanced_logging = EnhancedLogging()
-db = SQLAlchemy()
+server_timing = ServerTiming()
+metrics = Metrics()
+sql_statements = SQLStatements()
+db = MeteredSQLAlchemy()
 
 
 def register_extensions(app):
@@ -16,5 +36,14 @@ def register_extensions(app):
     # Database
     db.init_app(app)
 
+    # Breaks the time spent on each request down into validation, SQL, serialization and encoding, if turned on
+    server_timing.init_app(app)
+
+    # Counts and times requests, database connections, title locks and cache lookups, served by /metrics
+    metrics.init_app(app)
+
+    # Counts and times the SQL statements of each request, logging slow statements and requests over their budget
+    sql_statements.init_app(app)
+
     # All done!
     app.logger.info("Extensions registered")
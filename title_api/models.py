@@ -1,8 +1,17 @@
+from title_api.custom_extensions.metrics.main import count_lru_cache
+from title_api.custom_extensions.server_timing.main import timed
 from title_api.extensions import db
+from title_api.responses import dumps
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.sql import func
 from datetime import datetime
+from functools import lru_cache
 import json
 
+# Fields of a serialized title that a client can ask for
+title_fields = ("title_number", "owner", "address", "restrictions", "charges", "restriction_consenting_parties",
+                "price_history", "created_at", "updated_at", "locked_at")
+
 
 class Title(db.Model):
     __tablename__ = 'title'
@@ -12,10 +21,14 @@ class Title(db.Model):
     created_at = db.Column(db.DateTime, nullable=False, server_default=func.now())
     updated_at = db.Column(db.DateTime, nullable=True)
     lock = db.Column(db.DateTime, nullable=True)
-    owner_identity = db.Column(db.Integer, db.ForeignKey('owner.identity'), nullable=False)
+    owner_identity = db.Column(db.String, db.ForeignKey('owner.identity'), nullable=False, index=True)
     address_id = db.Column(db.Integer,
                            db.ForeignKey('address.address_id', ondelete="CASCADE", onupdate="CASCADE"),
-                           nullable=False)
+                           nullable=False, index=True)
+    # Precomputed JSON of as_dict, served as-is by GET /titles/<title_number>. Deferred as it is only read there.
+    document = db.deferred(db.Column(db.String, nullable=True))
+    # Incremented by every UPDATE of the title, which only applies if the row still has the version it was read with
+    version = db.Column(db.Integer, nullable=False, server_default='1')
 
     # Relationships
     owner = db.relationship("Owner", backref=db.backref('title', lazy='dynamic'),
@@ -26,6 +39,8 @@ class Title(db.Model):
     restrictions = db.relationship("Restriction", back_populates="title", cascade="all, delete-orphan")
     charges = db.relationship("Charge", back_populates="title", cascade="all, delete-orphan")
 
+    __mapper_args__ = {'version_id_col': version}
+
     # Methods
     def __init__(self, title_number, owner, address):
         self.title_number = title_number.upper()
@@ -34,34 +49,93 @@ class Title(db.Model):
         self.address = address
 
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
-
-    def as_dict(self):
-        restrictions_dict = [r.as_dict() for r in self.restrictions]
-
-        charges_dict = []
-        for charge in self.charges:
-            if charge.restriction is None:
-                charges_dict.append(charge.as_dict())
+        return dumps(self.as_dict())
 
-        restriction_consenting_parties_dict = []
-        for restriction in self.restrictions:
-            restriction_consenting_parties_dict.append(X500Name.from_string(restriction.consenting_party).as_dict())
+    def build_document(self):
+        """Serialize the title and store the result as its precomputed document."""
+        self.document = repr(self)
+        return self.document
 
-        price_history_dict = [r.as_dict() for r in self.price_history]
+    @staticmethod
+    def document_with_lock(document, lock):
+        """A stored document with its locked_at changed, giving the same result as rebuilding it from the title."""
+        title_dict = json.loads(document)
+        title_dict["locked_at"] = lock
+        return dumps(title_dict)
 
-        return {
-            "title_number": self.title_number,
-            "owner": self.owner.as_dict(),
-            "address": self.address.as_dict(),
-            "restrictions": restrictions_dict,
-            "charges": charges_dict,
-            "restriction_consenting_parties": restriction_consenting_parties_dict,
-            "price_history": price_history_dict,
-            "created_at": self.created_at.isoformat(),
-            "updated_at": self.updated_at.isoformat() if self.updated_at else self.updated_at,
-            "locked_at": self.lock.isoformat() if self.lock else self.lock
-        }
+    @staticmethod
+    def load_options(fields=None):
+        """Loader options that fetch everything as_dict needs in a fixed number of queries.
+
+        Many-to-one relationships are joined onto the title query, collections are each fetched with a single
+        SELECT ... IN, so the query count does not grow with the number of titles, restrictions or charges.
+        If fields is given only the relationships those fields need are loaded.
+        """
+        if fields is None:
+            fields = title_fields
+
+        options = []
+        if "owner" in fields:
+            options.append(joinedload(Title.owner).joinedload(Owner.address))
+        if "address" in fields:
+            options.append(joinedload(Title.address))
+        if "restrictions" in fields:
+            options.append(selectinload(Title.restrictions).joinedload(Restriction.charge))
+        elif "restriction_consenting_parties" in fields:
+            options.append(selectinload(Title.restrictions))
+        if "charges" in fields:
+            options.append(selectinload(Title.charges).joinedload(Charge.restriction))
+        if "price_history" in fields:
+            options.append(selectinload(Title.price_history))
+        return tuple(options)
+
+    @timed('serialize')
+    def as_dict(self, fields=None):
+        """Serialize the title, limited to the given fields if there are any.
+
+        The title_number is always included so that titles in a list can be told apart.
+        """
+        if fields is None:
+            fields = title_fields
+
+        title_dict = {"title_number": self.title_number}
+
+        if "owner" in fields:
+            title_dict["owner"] = self.owner.as_dict()
+
+        if "address" in fields:
+            title_dict["address"] = self.address.as_dict()
+
+        if "restrictions" in fields:
+            title_dict["restrictions"] = [r.as_dict() for r in self.restrictions]
+
+        if "charges" in fields:
+            charges_dict = []
+            for charge in self.charges:
+                if charge.restriction is None:
+                    charges_dict.append(charge.as_dict())
+            title_dict["charges"] = charges_dict
+
+        if "restriction_consenting_parties" in fields:
+            restriction_consenting_parties_dict = []
+            for restriction in self.restrictions:
+                restriction_consenting_parties_dict.append(
+                    X500Name.from_string(restriction.consenting_party).as_dict())
+            title_dict["restriction_consenting_parties"] = restriction_consenting_parties_dict
+
+        if "price_history" in fields:
+            title_dict["price_history"] = [r.as_dict() for r in self.price_history]
+
+        if "created_at" in fields:
+            title_dict["created_at"] = self.created_at
+
+        if "updated_at" in fields:
+            title_dict["updated_at"] = self.updated_at
+
+        if "locked_at" in fields:
+            title_dict["locked_at"] = self.lock
+
+        return title_dict
 
 
 class PriceHistory(db.Model):
@@ -87,13 +161,13 @@ class PriceHistory(db.Model):
             self.date = datetime.utcnow()
 
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
     def as_dict(self):
         return {
             "amount": self.price_amount,
             "currency_code": self.price_currency,
-            "date_iso": self.date.isoformat(),
+            "date_iso": self.date,
             "date": int(self.date.strftime('%s'))
         }
 
@@ -125,8 +199,9 @@ class Owner(db.Model):
         self.address = address
 
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
+    @timed('serialize')
     def as_dict(self):
         return {
             "identity": self.identity,
@@ -141,6 +216,7 @@ class Owner(db.Model):
 
 class Address(db.Model):
     __tablename__ = 'address'
+    __table_args__ = (db.Index('ix_address_postcode_house_name_or_number', 'postcode', 'house_name_or_number'),)
 
     # Fields
     address_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -161,7 +237,7 @@ class Address(db.Model):
         self.postcode = postcode
 
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
     def as_dict(self):
         return {
@@ -188,55 +264,76 @@ class Conveyancer(db.Model):
         self.company_name = company_name
 
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
+    @timed('serialize')
     def as_dict(self):
+        x500_name = X500Name.from_string(self.x500_name)
         return {
             "conveyancer_id": self.conveyancer_id,
-            "x500": X500Name.from_string(self.x500_name).as_dict(),
-            "x500_string": str(X500Name.from_string(self.x500_name)),
+            "x500": x500_name.as_dict(),
+            "x500_string": str(x500_name),
             "company_name": self.company_name
         }
 
 
 class X500Name(object):
-    """Class representation of an X500Name."""
+    """Class representation of an X500Name.
 
-    # Fields
-    organisation = None
-    locality = None
-    country = None
-    state = None
-    organisational_unit = None
-    common_name = None
+    X500Names are immutable value objects. Parsed and validated names are interned in a bounded cache, so the
+    same lender or consenting party string is only split and validated once per worker.
+    """
+    __slots__ = ('organisation', 'locality', 'country', 'state', 'organisational_unit', 'common_name',
+                 '_string', '_validated')
 
     # Methods
-    def __init__(self, organisation, locality, country):
-        self.organisation = organisation
-        self.locality = locality
-        self.country = country
+    def __init__(self, organisation, locality, country, state=None, organisational_unit=None, common_name=None):
+        object.__setattr__(self, 'organisation', organisation)
+        object.__setattr__(self, 'locality', locality)
+        object.__setattr__(self, 'country', country)
+        object.__setattr__(self, 'state', state)
+        object.__setattr__(self, 'organisational_unit', organisational_unit)
+        object.__setattr__(self, 'common_name', common_name)
+        object.__setattr__(self, '_string', None)
+        object.__setattr__(self, '_validated', False)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("X500Name is immutable, use replace() to make a modified copy")
+
+    def __delattr__(self, name):
+        raise AttributeError("X500Name is immutable")
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (X500Name, self._fields())
+
+    def __eq__(self, other):
+        if not isinstance(other, X500Name):
+            return NotImplemented
+        return self._fields() == other._fields()
+
+    def __hash__(self):
+        return hash(self._fields())
+
+    def _fields(self):
+        return (self.organisation, self.locality, self.country, self.state, self.organisational_unit,
+                self.common_name)
+
+    def replace(self, **kwargs):
+        """Return a new, unvalidated X500Name with the given fields replaced."""
+        fields = dict(zip(('organisation', 'locality', 'country', 'state', 'organisational_unit', 'common_name'),
+                          self._fields()))
+        fields.update(kwargs)
+        return X500Name(**fields)
 
     @staticmethod
     def from_string(str_obj):
-        items = {}
-        for item in str_obj.split(','):
-            k, v = item.split('=')
-            items[k.replace(' ', '')] = v
-
-        organisation = items.get('O')
-        locality = items.get('L')
-        country = items.get('C')
-        state = items.get('ST')
-        organisational_unit = items.get('OU')
-        common_name = items.get('CN')
-
-        x500name = X500Name(organisation, locality, country)
-        x500name.state = state
-        x500name.organisational_unit = organisational_unit
-        x500name.common_name = common_name
-
-        x500name.validate()
-        return x500name
+        return _x500_name_from_string(str_obj)
 
     @staticmethod
     def from_dict(dict_obj):
@@ -247,16 +344,13 @@ class X500Name(object):
         organisational_unit = dict_obj.get('organisational_unit')
         common_name = dict_obj.get('common_name')
 
-        x500name = X500Name(organisation, locality, country)
-        x500name.state = state
-        x500name.organisational_unit = organisational_unit
-        x500name.common_name = common_name
-
-        x500name.validate()
-        return x500name
+        return _x500_name_from_fields(organisation, locality, country, state, organisational_unit, common_name)
 
     # Based on: https://docs.corda.net/releases/release-V3.3/generating-a-node.html#node-naming
     def validate(self):
+        if self._validated:
+            return True
+
         # Check 3 required values exist
         if not self.organisation:
             raise TypeError("Missing: organisation")
@@ -299,24 +393,28 @@ class X500Name(object):
             # Check value has invalid characters
             if '\00' in item:
                 raise ValueError("Contains null character: " + name)
+
+        object.__setattr__(self, '_validated', True)
         return True
 
     def __str__(self, should_validate=True):
         if should_validate:
             self.validate()
 
-        items = []
-        items.append("O=" + self.organisation)
-        items.append("L=" + self.locality)
-        items.append("C=" + self.country)
-        if self.state:
-            items.append("ST=" + self.state)
-        if self.organisational_unit:
-            items.append("OU=" + self.organisational_unit)
-        if self.common_name:
-            items.append("CN=" + self.common_name)
-
-        return ','.join(items)
+        if self._string is None:
+            items = []
+            items.append("O=" + self.organisation)
+            items.append("L=" + self.locality)
+            items.append("C=" + self.country)
+            if self.state:
+                items.append("ST=" + self.state)
+            if self.organisational_unit:
+                items.append("OU=" + self.organisational_unit)
+            if self.common_name:
+                items.append("CN=" + self.common_name)
+            object.__setattr__(self, '_string', ','.join(items))
+
+        return self._string
 
     def __repr__(self):
         return str(self)
@@ -335,6 +433,32 @@ class X500Name(object):
         }
 
 
+# Maximum number of distinct X500Names kept parsed and validated per worker
+x500_name_cache_size = 1024
+
+
+@lru_cache(maxsize=x500_name_cache_size)
+def _x500_name_from_fields(organisation, locality, country, state, organisational_unit, common_name):
+    x500name = X500Name(organisation, locality, country, state, organisational_unit, common_name)
+    x500name.validate()
+    return x500name
+
+
+@lru_cache(maxsize=x500_name_cache_size)
+def _x500_name_from_string(str_obj):
+    items = {}
+    for item in str_obj.split(','):
+        k, v = item.split('=')
+        items[k.replace(' ', '')] = v
+
+    return _x500_name_from_fields(items.get('O'), items.get('L'), items.get('C'), items.get('ST'), items.get('OU'),
+                                  items.get('CN'))
+
+
+count_lru_cache('x500_name_from_fields', _x500_name_from_fields)
+count_lru_cache('x500_name_from_string', _x500_name_from_string)
+
+
 class Restriction(db.Model):
     """Class representation of a Restriction."""
     __tablename__ = 'restriction'
@@ -346,10 +470,10 @@ class Restriction(db.Model):
     restriction_text = db.Column(db.String, nullable=False)
     consenting_party = db.Column(db.String, nullable=False)
     restriction_date = db.Column(db.DateTime, nullable=False, server_default=func.now())
-    title_number = db.Column(db.String, db.ForeignKey('title.title_number'))
+    title_number = db.Column(db.String, db.ForeignKey('title.title_number'), index=True)
     charge_id = db.Column(db.Integer,
                           db.ForeignKey('charge.charge_id', ondelete="CASCADE", onupdate="CASCADE"),
-                          nullable=True)
+                          nullable=True, index=True)
 
     # Relationships
     title = db.relationship("Title", back_populates="restrictions")
@@ -385,17 +509,39 @@ class Restriction(db.Model):
 
         return restriction
 
+    def key(self):
+        """Hashable key of everything that is stored about the restriction, including its charge.
+
+        The date is left out as it is set when the restriction is created, rather than taken from the request.
+        """
+        return (self.restriction_code, self.restriction_type, self.restriction_text, self.consenting_party,
+                self.charge.key() if self.charge else None)
+
+    @staticmethod
+    def key_from_dict(dict_obj):
+        """Key of the restriction from_dict would build from the dict, without building it."""
+        if 'consenting_party_string' in dict_obj:
+            consenting_party = X500Name.from_string(dict_obj['consenting_party_string'])
+        else:
+            consenting_party = X500Name.from_dict(dict_obj['consenting_party'])
+
+        charge = dict_obj.get('charge')
+        return (dict_obj['restriction_id'].upper(), dict_obj['restriction_type'].upper(),
+                dict_obj['restriction_text'], str(X500Name.from_string(str(consenting_party))),
+                Charge.key_from_dict(charge) if charge else None)
+
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
     def as_dict(self):
+        consenting_party = X500Name.from_string(self.consenting_party)
         return {
             "restriction_id": self.restriction_code,
             "restriction_type": self.restriction_type,
             "restriction_text": self.restriction_text,
-            "consenting_party": X500Name.from_string(self.consenting_party).as_dict(),
-            "consenting_party_string": str(X500Name.from_string(self.consenting_party)),
-            "date": self.restriction_date.isoformat(),
+            "consenting_party": consenting_party.as_dict(),
+            "consenting_party_string": str(consenting_party),
+            "date": self.restriction_date,
             "charge": self.charge.as_dict() if self.charge else None
         }
 
@@ -410,7 +556,7 @@ class Charge(db.Model):
     charge_lender = db.Column(db.String, nullable=False)
     charge_amount = db.Column(db.Float, nullable=False)
     charge_currency_type = db.Column(db.String, nullable=False)
-    title_number = db.Column(db.String, db.ForeignKey('title.title_number'))
+    title_number = db.Column(db.String, db.ForeignKey('title.title_number'), index=True)
     # restriction_id = db.Column(db.String, db.ForeignKey('restriction.restriction_id'), nullable=True)
 
     # Relationships
@@ -440,14 +586,33 @@ class Charge(db.Model):
 
         return Charge(date, lender, amount, amount_currency_code, title_number)
 
+    def key(self):
+        """Hashable key of everything that is stored about the charge.
+
+        The date is left out as it is set when the charge is created, rather than taken from the request.
+        """
+        return (self.charge_lender, self.charge_amount, self.charge_currency_type)
+
+    @staticmethod
+    def key_from_dict(dict_obj):
+        """Key of the charge from_dict would build from the dict, without building it."""
+        if 'lender_string' in dict_obj:
+            lender = X500Name.from_string(dict_obj['lender_string'])
+        else:
+            lender = X500Name.from_dict(dict_obj['lender'])
+
+        return (str(X500Name.from_string(str(lender))), float(dict_obj['amount']),
+                dict_obj['amount_currency_code'].upper())
+
     def __repr__(self):
-        return json.dumps(self.as_dict(), sort_keys=True, separators=(',', ':'))
+        return dumps(self.as_dict())
 
     def as_dict(self):
+        lender = X500Name.from_string(self.charge_lender)
         return {
-            "date": self.charge_date.isoformat(),
-            "lender": X500Name.from_string(self.charge_lender).as_dict(),
-            "lender_string": str(X500Name.from_string(self.charge_lender)),
+            "date": self.charge_date,
+            "lender": lender.as_dict(),
+            "lender_string": str(lender),
             "amount": self.charge_amount,
             "amount_currency_code": self.charge_currency_type
         }
@@ -0,0 +1,67 @@
+import base64
+import binascii
+import json
+
+from flask import request
+
+from title_api.exceptions import ApplicationError
+
+# Largest page a client may ask for
+max_page_size = 1000
+
+
+def encode_cursor(key):
+    """Opaque cursor pointing after the row with the given primary key."""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, key_column):
+    """Primary key value a cursor points after, checked against the type of the key column."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, binascii.Error):
+        raise ApplicationError("`next` is not a valid cursor.", "E001", 400)
+
+    if not isinstance(key, key_column.type.python_type) or isinstance(key, bool):
+        raise ApplicationError("`next` is not a valid cursor.", "E001", 400)
+    return key
+
+
+def page_parameters():
+    """Get and check the `limit` and `next` query parameters of a paginated request.
+
+    limit is None when the client did not ask for pagination.
+    """
+    limit = request.args.get('limit')
+    cursor = request.args.get('next')
+
+    if limit is not None:
+        if not limit.isdigit() or not 1 <= int(limit) <= max_page_size:
+            raise ApplicationError("`limit` must be between 1 and {}.".format(max_page_size), "E001", 400)
+        limit = int(limit)
+    elif cursor is not None:
+        limit = max_page_size
+
+    return limit, cursor
+
+
+def paginate(query, key_column, limit, cursor):
+    """Run the query ordered on its primary key, returning one page of results and the cursor of the next page.
+
+    Pages are found by seeking past the last key of the previous page rather than with OFFSET, so every page
+    costs the same as the first. The next page cursor is None on the last page.
+    """
+    if cursor is not None:
+        query = query.filter(key_column > decode_cursor(cursor, key_column))
+    query = query.order_by(key_column)
+
+    if limit is None:
+        return query.all(), None
+
+    # Fetch one row more than asked for to find out whether there is a next page
+    results = query.limit(limit + 1).all()
+    if len(results) <= limit:
+        return results, None
+
+    results = results[:limit]
+    return results, encode_cursor(getattr(results[-1], key_column.key))
@@ -0,0 +1,177 @@
+from collections import defaultdict
+from datetime import datetime
+
+from dateutil.parser import isoparse
+from sqlalchemy import and_, bindparam, func, select
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm.attributes import set_committed_value
+
+from title_api.extensions import db
+from title_api.models import Charge, PriceHistory, Restriction
+
+
+def diff(existing, requested, key, requested_key):
+    """Match the requested items against the existing ones by key, in linear time.
+
+    Returns the existing items to keep, the existing items to delete and the requested items to insert. Keys are
+    matched as a multiset, so an item requested twice only matches twice if it exists twice.
+    """
+    unmatched = defaultdict(list)
+    for item in existing:
+        unmatched[key(item)].append(item)
+
+    kept = []
+    inserts = []
+    for item in requested:
+        matches = unmatched.get(requested_key(item))
+        if matches:
+            kept.append(matches.pop())
+        else:
+            inserts.append(item)
+
+    deletes = [item for matches in unmatched.values() for item in matches]
+    return kept, deletes, inserts
+
+
+def reconcile_restrictions_and_charges(title, title_request):
+    """Bring the restrictions and charges of a loaded title in line with a TitleRequest.
+
+    Only the ones that differ from the request are deleted or inserted, so an unchanged request writes nothing.
+    Both are issued straight away, with one statement per table whatever the number of rows. Returns whether
+    anything was changed.
+    """
+    title_number = title.title_number
+    standalone_charges = [charge for charge in title.charges if charge.restriction is None]
+
+    kept_restrictions, deleted_restrictions, new_restrictions = diff(
+        title.restrictions, title_request['restrictions'], Restriction.key, Restriction.key_from_dict)
+    kept_charges, deleted_charges, new_charges = diff(
+        standalone_charges, title_request['charges'], Charge.key, Charge.key_from_dict)
+
+    # A restriction's charge is part of its key, so it is kept or deleted along with it
+    kept_charges += [restriction.charge for restriction in kept_restrictions if restriction.charge]
+    deleted_charges += [restriction.charge for restriction in deleted_restrictions if restriction.charge]
+
+    if deleted_restrictions or deleted_charges:
+        # Restrictions go first as they reference charges
+        if deleted_restrictions:
+            Restriction.query.filter(Restriction.restriction_id.in_(
+                [restriction.restriction_id for restriction in deleted_restrictions])
+            ).delete(synchronize_session=False)
+        if deleted_charges:
+            Charge.query.filter(Charge.charge_id.in_(
+                [charge.charge_id for charge in deleted_charges])
+            ).delete(synchronize_session=False)
+
+        # The rows are already gone, so take them out of the session and the title's collections without the ORM
+        # trying to delete them again
+        for row in deleted_restrictions + deleted_charges:
+            db.session.expunge(row)
+        set_committed_value(title, 'restrictions', kept_restrictions)
+        set_committed_value(title, 'charges', kept_charges)
+
+    if new_restrictions or new_charges:
+        restrictions = [Restriction.from_dict(item, title_number) for item in new_restrictions]
+        charges = [Charge.from_dict(item, title_number) for item in new_charges]
+        insert_restrictions_and_charges(title, restrictions, charges)
+
+    return bool(deleted_restrictions or deleted_charges or new_restrictions or new_charges)
+
+
+def insert_restrictions_and_charges(title, restrictions, charges):
+    """Insert new restrictions, and new charges both of their own and of the restrictions, for a loaded title.
+
+    The charges are inserted in one batched statement, with ids taken up front so the restrictions can refer to them,
+    then the restrictions in another. The title's collections are expired, to be read again with the rows in them.
+    """
+    charges = charges + [restriction.charge for restriction in restrictions if restriction.charge]
+    charge_ids = next_ids(Charge.charge_id, len(charges))
+    for charge, charge_id in zip(charges, charge_ids):
+        charge.charge_id = charge_id
+
+    if charges:
+        db.session.execute(Charge.__table__.insert(), [row_values(charge) for charge in charges])
+    if restrictions:
+        db.session.execute(Restriction.__table__.insert(), [
+            dict(row_values(restriction), charge_id=restriction.charge.charge_id if restriction.charge else None)
+            for restriction in restrictions])
+
+    db.session.expire(title, ['restrictions', 'charges'])
+
+
+def next_ids(column, count):
+    """Take the next count values of an integer primary key column, in one statement."""
+    if not count:
+        return []
+    if db.engine.dialect.name == 'postgresql':
+        sequence = '{}_{}_seq'.format(column.table.name, column.name)
+        return [row[0] for row in db.session.execute(
+            select([func.nextval(sequence)]).select_from(func.generate_series(1, count)))]
+
+    # SQLite, which is only used by the tests, so nothing else inserts between reading the highest id and using it
+    highest = db.session.execute(select([func.coalesce(func.max(column), 0)])).scalar()
+    return list(range(highest + 1, highest + 1 + count))
+
+
+def row_values(row):
+    """Values of the columns of a model instance that isn't in the session, for a Core INSERT.
+
+    A primary key without a value is left out, for the database to generate.
+    """
+    values = {column.key: getattr(row, column.key) for column in row.__table__.columns}
+    return {key: value for key, value in values.items()
+            if value is not None or not row.__table__.columns[key].primary_key}
+
+
+def upsert_price_history(title, price_requests):
+    """Insert or update the prices of a loaded title from the price_history of a TitleRequest.
+
+    Prices are keyed by date, and those without one are dated now. Only the ones that differ from the title's are
+    written, in one INSERT ... ON CONFLICT DO UPDATE on PostgreSQL, or one batched INSERT and one batched UPDATE
+    elsewhere. Returns whether anything was changed.
+    """
+    existing = {price.date: price for price in title.price_history}
+
+    # A later price for the same date replaces an earlier one. The database ignores the offset of a date-time
+    # given for a timestamp column, so it is dropped here too.
+    rows = {}
+    for price_request in price_requests:
+        if price_request.get('date') is not None:
+            date = isoparse(price_request['date']).replace(tzinfo=None)
+        else:
+            date = datetime.utcnow()
+        rows[date] = {'title_number': title.title_number, 'date': date,
+                      'price_amount': price_request['amount'], 'price_currency': price_request['currency_code']}
+
+    existing_values = {date: (price.price_amount, price.price_currency) for date, price in existing.items()}
+    rows = [row for date, row in rows.items()
+            if existing_values.get(date) != (row['price_amount'], row['price_currency'])]
+    if not rows:
+        return False
+
+    price_table = PriceHistory.__table__
+    if db.engine.dialect.name == 'postgresql':
+        statement = postgresql.insert(price_table).values(rows)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=[price_table.c.title_number, price_table.c.date],
+            set_={'price_amount': statement.excluded.price_amount,
+                  'price_currency': statement.excluded.price_currency}))
+    else:
+        # SQLite, where the rows already loaded with the title tell which prices are new
+        inserts = [row for row in rows if row['date'] not in existing]
+        updates = [{'price_title_number': row['title_number'], 'price_date': row['date'],
+                    'price_amount': row['price_amount'], 'price_currency': row['price_currency']}
+                   for row in rows if row['date'] in existing]
+        if inserts:
+            db.session.execute(price_table.insert(), inserts)
+        if updates:
+            db.session.execute(price_table.update().where(and_(
+                price_table.c.title_number == bindparam('price_title_number'),
+                price_table.c.date == bindparam('price_date'))), updates)
+
+    # The prices were written without the ORM, so they are read again when the title's document is rebuilt
+    for row in rows:
+        if row['date'] in existing:
+            db.session.expire(existing[row['date']])
+    db.session.expire(title, ['price_history'])
+    return True
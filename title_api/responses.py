@@ -0,0 +1,104 @@
+from datetime import date
+import json
+import math
+import re
+
+from flask import Response
+
+from title_api.conditional import content_etag, not_modified
+from title_api.custom_extensions.server_timing.main import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _json_default(obj):
+    """Encode the types the standard library json module can't, the same way orjson does."""
+    if isinstance(obj, date):
+        return obj.isoformat()
+    raise TypeError("Object of type {} is not JSON serializable".format(type(obj).__name__))
+
+
+def stdlib_dumps(obj, sort_keys=True):
+    """Encode obj as compact JSON with the standard library."""
+    return json.dumps(obj, sort_keys=sort_keys, separators=(',', ':'), default=_json_default)
+
+
+# orjson writes non-ASCII characters and DEL unescaped, and floats below 1e-4 or from 1e16 up without Python's
+# exponent format. Output that might contain any of them is encoded again with the standard library, so both encoders
+# give the same bytes. Non-finite floats, which are not valid JSON, are written as null by orjson rather than as NaN or
+# Infinity, so output with a null in it is checked for them.
+_orjson_differs = re.compile(rb'[^\x00-\x7e]|[0-9]e|(?:^|[:,\[])-?0\.0000')
+
+
+def _has_non_finite(obj):
+    """Whether obj is, or contains, a NaN or infinite float."""
+    if isinstance(obj, float):
+        return not math.isfinite(obj)
+    if isinstance(obj, dict):
+        return any(_has_non_finite(value) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite(value) for value in obj)
+    return False
+
+
+def orjson_dumps(obj, sort_keys=True):
+    """Encode obj as compact JSON with orjson, giving exactly the same output as stdlib_dumps."""
+    try:
+        encoded = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    except orjson.JSONEncodeError:
+        return stdlib_dumps(obj, sort_keys)
+
+    if _orjson_differs.search(encoded) or (b'null' in encoded and _has_non_finite(obj)):
+        return stdlib_dumps(obj, sort_keys)
+    return encoded.decode('ascii')
+
+
+encoders = {'json': stdlib_dumps}
+if orjson is not None:
+    encoders['orjson'] = orjson_dumps
+
+# Encoder used for every response body and model __repr__, the fastest one installed
+encoder = encoders['orjson'] if orjson is not None else encoders['json']
+
+
+def use_encoder(name):
+    """Switch the encoder used by dumps to one of encoders."""
+    global encoder
+    encoder = encoders[name]
+
+
+@timed('encode')
+def dumps(obj, sort_keys=True):
+    """Encode obj as compact JSON text. Dates and datetimes are written in ISO 8601 format."""
+    return encoder(obj, sort_keys)
+
+
+def json_response(body, etag=None, status=200):
+    """Build a JSON response carrying an ETag, or a 304 if the client already holds that version.
+
+    If no etag is given it is derived from the body.
+    """
+    if etag is None:
+        etag = content_etag(body)
+
+    response = not_modified(etag)
+    if response is None:
+        response = Response(response=body, mimetype='application/json', status=status)
+        response.set_etag(etag)
+    return response
+
+
+def json_text_response(body, status=200, etag=None):
+    """Build a response from already encoded JSON text, such as a stored title document."""
+    response = Response(response=body, mimetype='application/json', status=status)
+    if etag is not None:
+        response.set_etag(etag)
+    return response
+
+
+def json_object_response(obj, status=200, sort_keys=True):
+    """Build a response by encoding obj, for bodies that aren't cached by clients such as errors."""
+    return json_text_response(dumps(obj, sort_keys), status)
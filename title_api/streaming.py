@@ -0,0 +1,64 @@
+from flask import current_app, request, stream_with_context
+
+from title_api.exceptions import ApplicationError
+from title_api.responses import dumps, json_text_response
+
+# Number of rows fetched from the database, and written to the client, at a time
+stream_batch_size = 100
+
+
+def stream_requested():
+    """Whether the client asked for the results to be streamed, which can't be combined with pagination."""
+    if request.args.get('stream') != 'true':
+        return False
+    if request.args.get('limit') is not None or request.args.get('next') is not None:
+        raise ApplicationError("`stream` cannot be used with `limit` or `next`.", "E001", 400)
+    return True
+
+
+def keyset_batches(query, key_column):
+    """Yield the rows of the query in primary key order, fetching them one batch at a time.
+
+    Used for queries with eager loaded collections, which can't be read through a server-side cursor.
+    """
+    batch_size = stream_batch_size
+    last_key = None
+    while True:
+        batch_query = query if last_key is None else query.filter(key_column > last_key)
+        rows = batch_query.order_by(key_column).limit(batch_size).all()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_key = getattr(rows[-1], key_column.key)
+
+
+def json_array_chunks(rows, as_dict=None):
+    """Serialize the rows into a JSON array, yielding one chunk of the array per batch of rows.
+
+    Each row is turned into a dict by as_dict, or its own as_dict method if none is given. The chunks join up to
+    exactly the same output as dumps of the whole list.
+    """
+    batch_size = stream_batch_size
+    yield '['
+    separator = ''
+    chunk = []
+    try:
+        for row in rows:
+            chunk.append(dumps(as_dict(row) if as_dict else row.as_dict()))
+            if len(chunk) == batch_size:
+                yield separator + ','.join(chunk)
+                separator = ','
+                chunk = []
+    except Exception:
+        # The status has already been sent so all that can be done is to log and end the (truncated) response
+        current_app.logger.exception('Failed while streaming response')
+        return
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']'
+
+
+def streamed_json_response(rows, as_dict=None):
+    """Build a 200 response that streams the rows as a JSON array while they are fetched."""
+    return json_text_response(stream_with_context(json_array_chunks(rows, as_dict)))
@@ -0,0 +1,57 @@
+import json
+
+from jsonschema import Draft4Validator, FormatChecker, RefResolver
+
+from title_api.custom_extensions.server_timing.main import timed
+from title_api.exceptions import ApplicationError
+
+openapi_filepath = 'openapi.json'
+
+# The request bodies that are validated, by their schema in openapi.json
+request_schemas = ['TitleRequest', 'TitleLookupRequest', 'TitleBulkRequest']
+
+with open(openapi_filepath) as json_file:
+    openapi = json.load(json_file)
+
+ref_resolver = RefResolver(openapi_filepath, openapi)
+format_checker = FormatChecker()
+
+
+def inline_refs(schema, refs=()):
+    """Copy of a schema with every $ref into openapi.json replaced by what it refers to.
+
+    A $ref replaces the whole object it is in, as its siblings are ignored when validating. Refs that recur
+    within themselves are left to be resolved when validating.
+    """
+    if isinstance(schema, list):
+        return [inline_refs(item, refs) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    if '$ref' in schema:
+        ref = schema['$ref']
+        if ref in refs:
+            return schema
+        _, resolved = ref_resolver.resolve(ref)
+        return inline_refs(resolved, refs + (ref,))
+    return {key: inline_refs(value, refs) for key, value in schema.items()}
+
+
+def compile_validator(name):
+    """Check a schema of openapi.json and build the validator for it, with its $refs already resolved."""
+    schema = inline_refs(openapi['components']['schemas'][name])
+    Draft4Validator.check_schema(schema)
+    return Draft4Validator(schema, resolver=ref_resolver, format_checker=format_checker)
+
+
+# Built once when the app starts, and shared by every request
+validators = {name: compile_validator(name) for name in request_schemas}
+
+
+@timed('validation')
+def validate_request(name, instance):
+    """Validate a request body against a schema of openapi.json.
+
+    Raises the E001 error for the first problem found, with the same message as jsonschema.validate gives.
+    """
+    for error in validators[name].iter_errors(instance):
+        raise ApplicationError(error.message, "E001", 400)
@@ -1,10 +1,12 @@
-import json
-
-from flask import Blueprint, Response, current_app
+from flask import Blueprint, current_app
 from flask_negotiate import produces
 
+from title_api.conditional import model_etag, not_modified
 from title_api.exceptions import ApplicationError
 from title_api.models import Conveyancer
+from title_api.pagination import page_parameters, paginate
+from title_api.responses import dumps, json_response
+from title_api.streaming import stream_batch_size, stream_requested, streamed_json_response
 
 # This is the blueprint object that gets registered into the app in blueprints.py.
 conveyancer_v1 = Blueprint('conveyancer_v1', __name__)
@@ -18,15 +20,28 @@ def get_conveyancers():
     current_app.logger.info('Starting get_conveyancers method')
     results = []
 
-    query_result = Conveyancer.query.all()
+    # Stream all of the conveyancers through a server-side cursor, rather than holding them all in memory
+    if stream_requested():
+        query_result = Conveyancer.query.order_by(Conveyancer.conveyancer_id).yield_per(stream_batch_size)
+        return streamed_json_response(query_result)
 
-    # Format/Process
-    for item in query_result:
-        results.append(item.as_dict())
+    limit, cursor = page_parameters()
+    query_result, next_cursor = paginate(Conveyancer.query, Conveyancer.conveyancer_id, limit, cursor)
 
-    # Output
-    return Response(response=json.dumps(results, sort_keys=True, separators=(',', ':')),
-                    mimetype='application/json', status=200)
+    # Answer conditional requests from the loaded rows, before serializing them
+    etag = model_etag(*query_result)
+    response = not_modified(etag)
+    if not response:
+        # Format/Process
+        for item in query_result:
+            results.append(item.as_dict())
+
+        # Output
+        response = json_response(dumps(results), etag)
+
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @conveyancer_v1.route("/conveyancers/<int:conveyancer_id>", methods=["GET"])
@@ -43,9 +58,14 @@ def get_conveyancer(conveyancer_id):
     if not query_result:
         raise ApplicationError("A conveyancer with the specified conveyancer ID was not found.", "E002", 404)
 
-        # Format/Process
+    # Answer conditional requests from the loaded row, before serializing it
+    etag = model_etag(query_result)
+    not_modified_response = not_modified(etag)
+    if not_modified_response:
+        return not_modified_response
+
+    # Format/Process
     result = query_result.as_dict()
 
     # Output
-    return Response(response=json.dumps(result, sort_keys=True, separators=(',', ':')),
-                    mimetype='application/json', status=200)
+    return json_response(dumps(result), etag)
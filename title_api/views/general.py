@@ -1,8 +1,13 @@
+from concurrent import futures
+from prometheus_client import CONTENT_TYPE_LATEST
+from title_api.custom_extensions.metrics.main import latest
 from title_api.dependencies import postgres
+from title_api.extensions import enhanced_logging
 import datetime
-import json
+import time
 
 from flask import Blueprint, Response, current_app, g, request
+from title_api.responses import json_object_response
 
 # This is the blueprint object that gets registered into the app in blueprints.py.
 general = Blueprint('general', __name__)
@@ -10,12 +15,17 @@ general = Blueprint('general', __name__)
 
 @general.route("/health")
 def check_status():
-    return Response(response=json.dumps({
+    return json_object_response({
         "app": current_app.config["APP_NAME"],
         "status": "OK",
         "headers": request.headers.to_wsgi_list(),
         "commit": current_app.config["COMMIT"]
-    }, separators=(',', ':')), mimetype='application/json', status=200)
+    }, 200, sort_keys=False)
+
+
+@general.route("/metrics")
+def get_metrics():
+    return Response(latest(), content_type=CONTENT_TYPE_LATEST)
 
 
 @general.route("/health/cascade/<int:depth>")
@@ -23,88 +33,56 @@ def cascade_health(depth):
     if (depth < 0) or (depth > current_app.config.get("MAX_HEALTH_CASCADE")):
         current_app.logger.error("Cascade depth {} out of allowed range (0 - {})"
                                  .format(depth, current_app.config.get("MAX_HEALTH_CASCADE")))
-        return Response(response=json.dumps({
+        return json_object_response({
             "app": current_app.config.get("APP_NAME"),
             "cascade_depth": depth,
             "status": "ERROR",
             "timestamp": str(datetime.datetime.utcnow())
-        }, separators=(',', ':')), mimetype='application/json', status=500)
+        }, 500, sort_keys=False)
+    # Every dependency is checked at once on the shared pool. Each has its own deadline, and none can run past the
+    # cascade's overall budget, so one slow dependency can't hold up the whole response. The checks themselves give up
+    # at the deadline too, so a hung dependency can't keep the pool's threads from later cascades.
+    started = time.monotonic()
+    dependency_timeout = current_app.config["HEALTH_CASCADE_DEPENDENCY_TIMEOUT"]
+    deadline = started + min(dependency_timeout, current_app.config["HEALTH_CASCADE_TIMEOUT"])
+    pool = current_app.extensions["health_cascade_pool"]
+    app = current_app._get_current_object()
+    checks = []
+    for dependency, value in (current_app.config.get("DEPENDENCIES") or {}).items():
+        # Below is an example of hitting a database dependency - in this instance postgresql
+        # It requires a route to obtain the current timestamp to be declared somewhere in code
+        # In the below example we have an sql.py script containing the get_current_timestamp() function
+        if "postgres" in value:
+            checks.append((dependency, "db", pool.submit(run_check, app, g.trace_id, check_database, dependency)))
+        elif depth > 0:
+            checks.append((dependency, "http", pool.submit(run_check, app, g.trace_id, check_service, dependency,
+                                                           value, depth, enhanced_logging.requests, deadline)))
+
     dbs = []
     services = []
     # if we encounter a failure at any point then this will be set to != 200
     overall_status = 200
-    if current_app.config.get("DEPENDENCIES") is not None:
-        for dependency, value in current_app.config.get("DEPENDENCIES").items():
-            # Below is an example of hitting a database dependency - in this instance postgresql
-            # It requires a route to obtain the current timestamp to be declared somewhere in code
-            # In the below example we have an sql.py script containing the get_current_timestamp() function
-            if "postgres" in value:
-                # postgres db url - try calling current timestamp routine
-                db = {}
-                db["name"] = dependency
-                try:
-                    db_timestamp = db_timestamp = postgres.get_current_timestamp()
-                    # trim microseconds to 3 to match java
-                    db["current_timestamp"] = db_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
-                    db["status"] = "OK"
-                except Exception as e:
-                    current_app.logger.error("Unknown error occured during health cascade on request to database: {};"
-                                             " full error: {}.".format(dependency, e))
-                    overall_status = 500
-                    db["status"] = "BAD"
-                finally:
-                    dbs.append(db)
-            else:
-                if depth > 0:
-                    # As there is an inconsistant approach to url variables we need to check
-                    # to see if we have a trailing '/' and add one if not
-                    if value[-1] != '/':
-                        value = value + '/'
-                    # Setup our service entry
-                    service = {
-                        "name": dependency,
-                        "type": "http"
-                    }
-                    try:
-                        # Try and request the health
-                        resp = g.requests.get(
-                            value + 'health/cascade/' + str(depth - 1))
-                    except ConnectionAbortedError as e:  # More specific logging statement for abortion error
-                        current_app.logger.error("Connection Aborted during health cascade on \
-                                                 attempt to connect to {}; full error: {}".format(dependency, e))
-                        service["status"] = "UNKNOWN"
-                        overall_status = 500
-                        service["status_code"] = None
-                        service["content_type"] = None
-                        service["content"] = None
-                    except Exception as e:  # Generic catch-all exception
-                        current_app.logger.error("Unknown error occured during health cascade on request to {};"
-                                                 " full error: {}".format(dependency, e))
-                        service["status"] = "UNKNOWN"
-                        overall_status = 500
-                        service["status_code"] = None
-                        service["content_type"] = None
-                        service["content"] = None
-                    else:   # Everything worked
-                        service["status_code"] = resp.status_code
-                        service["content_type"] = resp.headers["content-type"]
-                        service["content"] = resp.json()
-                        if resp.status_code == 200:  # Happy route, happy service, happy status_code.
-                            service["status"] = "OK"
-                        elif resp.status_code == 500:  # Something went wrong
-                            service["status"] = "BAD"
-                            overall_status = 500
-                        else:   # Who knows what happened.
-                            service["status"] = "UNKNOWN"
-                            overall_status = 500
-                    finally:
-                        services.append(service)
+    for dependency, check_type, future in checks:
+        try:
+            entry, ok = future.result(timeout=max(deadline - time.monotonic(), 0))
+        except futures.TimeoutError:
+            future.cancel()
+            current_app.logger.error("Timed out after {:.1f}s during health cascade on request to {}"
+                                     .format(time.monotonic() - started, dependency))
+            entry, ok = (failed_database(dependency) if check_type == "db" else failed_service(dependency)), False
+        if not ok:
+            overall_status = 500
+        if check_type == "db":
+            dbs.append(entry)
+        else:
+            services.append(entry)
+
     response_json = {
         "cascade_depth": depth,
         "server_timestamp": str(datetime.datetime.now()),
         "app": current_app.config.get("APP_NAME"),
         "status": "UNKNOWN",
-        "headers": request.headers.to_list(),
+        "headers": request.headers.to_wsgi_list(),
         "commit": current_app.config.get("COMMIT"),
         "db": dbs,
         "services": services
@@ -113,5 +91,107 @@ def cascade_health(depth):
         response_json['status'] = "BAD"
     else:
         response_json['status'] = "OK"
-    return Response(response=json.dumps(response_json, separators=(',', ':')),
-                    mimetype='application/json', status=overall_status)
+    return json_object_response(response_json, overall_status, sort_keys=False)
+
+
+@general.record_once
+def create_health_cascade_pool(state):
+    """Create the bounded pool that cascade_health checks its dependencies on, shared by every request."""
+    state.app.extensions["health_cascade_pool"] = futures.ThreadPoolExecutor(
+        max_workers=state.app.config["HEALTH_CASCADE_WORKERS"], thread_name_prefix="health-cascade")
+
+
+def run_check(app, trace_id, check, *args):
+    """Run a dependency check on a pool thread, in an app context carrying the trace id of the request."""
+    with app.app_context():
+        g.trace_id = trace_id
+        return check(*args)
+
+
+def check_database(dependency):
+    """Check a database dependency, returning its entry in the response and whether it is healthy."""
+    # postgres db url - try calling current timestamp routine
+    db = {}
+    db["name"] = dependency
+    try:
+        db_timestamp = postgres.get_current_timestamp()
+        # trim microseconds to 3 to match java
+        db["current_timestamp"] = db_timestamp.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + 'Z'
+        db["status"] = "OK"
+    except Exception as e:
+        current_app.logger.error("Unknown error occured during health cascade on request to database: {};"
+                                 " full error: {}.".format(dependency, e))
+        db["status"] = "BAD"
+    # How much of the connection pool is in use, which is worth knowing whether or not the probe worked
+    pool_status = postgres.get_pool_status()
+    if pool_status is not None:
+        db["pool"] = pool_status
+    return db, db["status"] == "OK"
+
+
+def check_service(dependency, value, depth, session, deadline):
+    """Check the cascade of an HTTP dependency, returning its entry in the response and whether it is healthy."""
+    # A check that waited on the pool until its deadline has passed isn't worth starting
+    budget = deadline - time.monotonic()
+    if budget <= 0:
+        return failed_service(dependency), False
+    # As there is an inconsistant approach to url variables we need to check
+    # to see if we have a trailing '/' and add one if not
+    if value[-1] != '/':
+        value = value + '/'
+    # Setup our service entry
+    service = {
+        "name": dependency,
+        "type": "http"
+    }
+    try:
+        # Try and request the health, giving up at the dependency's deadline whatever retries the session makes
+        resp = session.get(value + 'health/cascade/' + str(depth - 1), timeout=attempt_timeout(budget))
+    except ConnectionAbortedError as e:  # More specific logging statement for abortion error
+        current_app.logger.error("Connection Aborted during health cascade on \
+                                 attempt to connect to {}; full error: {}".format(dependency, e))
+        return failed_service(dependency), False
+    except Exception as e:  # Generic catch-all exception
+        current_app.logger.error("Unknown error occured during health cascade on request to {};"
+                                 " full error: {}".format(dependency, e))
+        return failed_service(dependency), False
+    # Everything worked
+    service["status_code"] = resp.status_code
+    service["content_type"] = resp.headers["content-type"]
+    service["content"] = resp.json()
+    if resp.status_code == 200:  # Happy route, happy service, happy status_code.
+        service["status"] = "OK"
+    elif resp.status_code == 500:  # Something went wrong
+        service["status"] = "BAD"
+    else:   # Who knows what happened.
+        service["status"] = "UNKNOWN"
+    return service, service["status"] == "OK"
+
+
+def attempt_timeout(budget):
+    """Connect and read timeouts for each attempt at a call on the shared session.
+
+    They are small enough that every attempt the session may make, and the backoffs between them, fit in the budget.
+    """
+    retries = current_app.config["OUTBOUND_RETRIES"]
+    # urllib3 doesn't back off before the first retry, then backs off for twice as long before each one after it
+    backoffs = sum(current_app.config["OUTBOUND_RETRY_BACKOFF"] * 2 ** retry for retry in range(1, retries))
+    timeout = max(budget - backoffs, 0.001) / (retries + 1) / 2
+    return timeout, timeout
+
+
+def failed_database(dependency):
+    """Entry for a database dependency whose check failed or didn't complete."""
+    return {"name": dependency, "status": "BAD"}
+
+
+def failed_service(dependency):
+    """Entry for an HTTP dependency whose check failed or didn't complete."""
+    return {
+        "name": dependency,
+        "type": "http",
+        "status": "UNKNOWN",
+        "status_code": None,
+        "content_type": None,
+        "content": None
+    }
@@ -1,8 +1,9 @@
-import json
-from flask import Blueprint, Response, current_app, request
+from flask import Blueprint, current_app, request
 from flask_negotiate import produces
+from title_api.conditional import model_etag, not_modified
 from title_api.exceptions import ApplicationError
 from title_api.models import Owner
+from title_api.responses import dumps, json_response
 
 # This is the blueprint object that gets registered into the app in blueprints.py.
 owner_v1 = Blueprint('owner_v1', __name__)
@@ -24,8 +25,14 @@ def get_owner():
     else:
         raise ApplicationError("'email_address' is required.", "E001", 400)
 
+    etag = None
     if owner_result:
+        # Answer conditional requests from the loaded rows, before serializing them
+        etag = model_etag(owner_result, owner_result.address)
+        not_modified_response = not_modified(etag)
+        if not_modified_response:
+            return not_modified_response
+
         response.append(owner_result.as_dict())
 
-    return Response(response=json.dumps(response, sort_keys=True, separators=(',', ':')),
-                    mimetype='application/json', status=200)
+    return json_response(dumps(response), etag)
@@ -1,25 +1,22 @@
 from datetime import datetime, timedelta
-import json
-from flask import Blueprint, Response, current_app, request
+from flask import Blueprint, current_app, request
 from flask_negotiate import consumes, produces
-from jsonschema import FormatChecker, RefResolver, ValidationError, validate
-from sqlalchemy import exc
+from sqlalchemy import and_, exc, func, or_
+from sqlalchemy.orm.exc import StaleDataError
+from title_api.conditional import not_modified, precondition_failed, version_etag, versions_etag
+from title_api.custom_extensions.metrics.main import counts_lock_outcome, record_cache_lookups
 from title_api.exceptions import ApplicationError
 from title_api.extensions import db
-from title_api.models import Address, Owner, Title, Charge, Restriction, PriceHistory
+from title_api.models import Address, Owner, Title, title_fields
+from title_api.pagination import page_parameters, paginate
+from title_api.reconciliation import reconcile_restrictions_and_charges, upsert_price_history
+from title_api.responses import dumps, json_response, json_text_response
+from title_api.streaming import keyset_batches, stream_requested, streamed_json_response
+from title_api.validation import validate_request
 
 # This is the blueprint object that gets registered into the app in blueprints.py.
 title_v1 = Blueprint('title_v1', __name__)
 
-openapi_filepath = 'openapi.json'
-
-# JSON schema for title requests
-with open(openapi_filepath) as json_file:
-    openapi = json.load(json_file)
-
-ref_resolver = RefResolver(openapi_filepath, openapi)
-title_request_schema = openapi["components"]["schemas"]["TitleRequest"]
-
 days_to_lock_title_for = 30
 
 
@@ -35,33 +32,57 @@ def get_titles():
     owner_identity = request.args.get('owner_identity')
     address_house_name_number = request.args.get('address_house_name_number')
     address_postcode = request.args.get('address_postcode')
+    fields = requested_fields()
 
-    if owner_email_address:
-        owner_result = Owner.query.filter_by(email=owner_email_address.lower()).first()
-        title_result = Title.query.filter_by(owner=owner_result)
-    elif owner_identity:
-        owner_result = Owner.query.filter_by(identity=owner_identity).first()
-        title_result = Title.query.filter_by(owner=owner_result)
-    else:
+    if not owner_email_address and not owner_identity:
         raise ApplicationError("`owner_identity` or `owner_email_address` is required.", "E001", 400)
-
-    if address_house_name_number and address_postcode:
-        address_result = Address.query.filter_by(house_name_or_number=address_house_name_number)
-        address_result = address_result.filter_by(postcode=address_postcode)
-        address_result = address_result.first()
-        title_result = title_result.filter_by(address=address_result).limit(1)
-    elif bool(address_house_name_number) != bool(address_postcode):  # XOR
+    if bool(address_house_name_number) != bool(address_postcode):  # XOR
         raise ApplicationError("`address_house_name_number` AND `address_postcode` are required", "E001", 400)
 
+    stream = stream_requested()
+    limit, cursor = page_parameters()
+
+    # Filter on the owner's, and the title's address, columns in the same query that fetches the titles
+    title_result = Title.query.options(*Title.load_options(fields)).join(Title.owner)
+    if owner_email_address:
+        title_result = title_result.filter(Owner.email == owner_email_address.lower())
+    else:
+        title_result = title_result.filter(Owner.identity == owner_identity)
+
+    # An address identifies a single title, which is returned on its own, without pagination or streaming
+    single_title = bool(address_house_name_number and address_postcode)
+    if single_title:
+        title_result = title_result.join(Title.address) \
+            .filter(Address.house_name_or_number == address_house_name_number, Address.postcode == address_postcode)
+        stream, limit, cursor = False, 1, None
+
+    # Stream all of the titles as they are fetched, rather than holding them all in memory
+    if stream and limit is None:
+        return streamed_json_response(keyset_batches(title_result, Title.title_number),
+                                      lambda title: title.as_dict(fields))
+
+    # A client revalidating its copy is answered from the titles' versions, without loading or serializing them
+    if request.if_none_match:
+        versions, next_cursor = paginate(title_result.with_entities(Title.title_number, Title.version),
+                                         Title.title_number, limit, cursor)
+        response = not_modified(versions_etag(versions, fields, None if single_title else next_cursor))
+        if response is not None:
+            return response
+
     # Finalise db query
-    title_result = title_result.all()
+    title_result, next_cursor = paginate(title_result, Title.title_number, limit, cursor)
+    if single_title:
+        next_cursor = None
 
-    # Build JSON
+    # Build JSON, the ETag is made from the versions of the titles listed
     for item in title_result:
-        results.append(item.as_dict())
+        results.append(item.as_dict(fields))
 
-    return Response(response=json.dumps(results, sort_keys=True, separators=(',', ':')),
-                    mimetype='application/json', status=200)
+    etag = versions_etag([(item.title_number, item.version) for item in title_result], fields, next_cursor)
+    response = json_response(dumps(results), etag=etag)
+    if next_cursor:
+        response.headers['X-Next-Cursor'] = next_cursor
+    return response
 
 
 @title_v1.route("/titles/<string:title_number>", methods=["GET"])
@@ -69,20 +90,145 @@ def get_titles():
 def get_title(title_number):
     """Get a Title for a given title_number."""
     current_app.logger.info('Starting get_title method')
-
-    # Query DB
-    query_result = Title.query.get(title_number)
+    fields = requested_fields()
+
+    # A subset of the title is serialized from the ORM, loading only the relationships those fields need
+    if fields is not None:
+        # A client revalidating its copy is answered from the title's version, without loading the title
+        if request.if_none_match:
+            version = Title.query.with_entities(Title.version).filter_by(title_number=title_number).scalar()
+            response = None if version is None else not_modified(version_etag(version, fields))
+            if response is not None:
+                return response
+
+        query_result = Title.query.options(*Title.load_options(fields)).get(title_number)
+        if not query_result:
+            raise ApplicationError("A title with the specified title number was not found.", "E002", 404)
+        return json_response(dumps(query_result.as_dict(fields)), etag=version_etag(query_result.version, fields))
+
+    # Query DB for the stored document only, the title's relationships are not needed to serve it
+    query_result = Title.query.with_entities(Title.document, Title.version).filter_by(title_number=title_number) \
+        .first()
 
     # Throw if not found
     if not query_result:
         raise ApplicationError("A title with the specified title number was not found.", "E002", 404)
 
-    # Format/Process
-    result = query_result.as_dict()
+    result = query_result.document
 
-    # Output
-    return Response(response=json.dumps(result, sort_keys=True, separators=(',', ':')),
-                    mimetype='application/json', status=200)
+    # Titles that have not had their document built yet are serialized from the ORM
+    record_cache_lookups('title_document', hits=int(result is not None), misses=int(result is None))
+    if result is None:
+        result = repr(Title.query.options(*Title.load_options()).get(title_number))
+
+    # Output, the ETag is the title's version so a matching If-None-Match is answered with a 304
+    return json_response(result, etag=version_etag(query_result.version))
+
+
+@title_v1.route("/titles", methods=["PUT"])
+@consumes("application/json")
+@produces("application/json")
+def bulk_update_titles():
+    """Update many Titles, reporting the outcome of each one."""
+    bulk_request = request.json
+    current_app.logger.info('Starting bulk_update_titles method')
+
+    # Validate the whole input before anything is applied
+    validate_request('TitleBulkRequest', bulk_request)
+
+    title_requests = bulk_request['titles']
+    title_numbers = [title_request['title_number'] for title_request in title_requests]
+    if len(set(title_numbers)) != len(title_numbers):
+        raise ApplicationError("Each title number can only be updated once per request.", "E001", 400)
+
+    # By default the whole batch is one transaction, otherwise it is committed every chunk_size titles
+    chunk_size = request.args.get('chunk_size')
+    if chunk_size is None:
+        chunk_size = len(title_requests)
+    elif not chunk_size.isdigit() or int(chunk_size) < 1:
+        raise ApplicationError("`chunk_size` must be a positive integer.", "E001", 400)
+    else:
+        chunk_size = int(chunk_size)
+
+    results = {}
+    for chunk_start in range(0, len(title_requests), chunk_size):
+        chunk = title_requests[chunk_start:chunk_start + chunk_size]
+
+        # Load every title in the chunk, with everything needed to update and serialize them, at once
+        titles = Title.query.options(*Title.load_options()) \
+            .filter(Title.title_number.in_([title_request['title_number'] for title_request in chunk])).all()
+        titles = {title.title_number: title for title in titles}
+
+        for title_request in chunk:
+            title_number = title_request['title_number']
+            # Each title is applied in its own savepoint, so a failure only rolls back that title
+            try:
+                if title_number not in titles:
+                    raise ApplicationError("A title with the specified title number was not found.", 'E404', 404)
+                with db.session.begin_nested():
+                    documents = apply_title_request(titles[title_number], title_request)
+            except ApplicationError as e:
+                results[title_number] = dumps({"status": e.http_code, "error_code": e.code,
+                                               "error_message": e.message})
+            except exc.IntegrityError:
+                results[title_number] = dumps({"status": 409, "error_code": "E003",
+                                               "error_message": "Failed to commit."})
+            except StaleDataError:
+                results[title_number] = dumps({"status": 409, "error_code": "E409",
+                                               "error_message": "The title was changed by another request."})
+            except Exception as e:
+                # Titles in earlier chunks are already committed, so the batch carries on rather than failing
+                current_app.logger.exception('Failed to update title %s: %s', title_number, repr(e))
+                results[title_number] = dumps({"status": 500, "error_code": "500",
+                                               "error_message": "Internal Server Error"})
+            else:
+                results[title_number] = '{{"status":200,"title":{}}}'.format(documents[title_number])
+
+        db.session.commit()
+
+    # Output, the title documents are already JSON so are joined into the map rather than decoded and encoded again
+    result = ','.join('{}:{}'.format(dumps(title_number), item) for title_number, item in sorted(results.items()))
+    return json_text_response('{' + result + '}')
+
+
+@title_v1.route("/titles/lookup", methods=["POST"])
+@consumes("application/json")
+@produces("application/json")
+def lookup_titles():
+    """Get the Titles for a list of title_numbers."""
+    lookup_request = request.json
+    current_app.logger.info('Starting lookup_titles method')
+
+    # Validate input
+    validate_request('TitleLookupRequest', lookup_request)
+
+    # Titles that are not found stay as None
+    title_numbers = set(lookup_request['title_numbers'])
+    documents = dict.fromkeys(title_numbers)
+
+    # Query DB for the stored documents of all of the titles at once
+    missing_documents = []
+    query_result = Title.query.with_entities(Title.title_number, Title.document) \
+        .filter(Title.title_number.in_(title_numbers)).all()
+    for item in query_result:
+        if item.document is None:
+            missing_documents.append(item.title_number)
+        else:
+            documents[item.title_number] = item.document
+    record_cache_lookups('title_document', hits=len(query_result) - len(missing_documents),
+                         misses=len(missing_documents))
+
+    # Titles without a stored document are serialized from the ORM, loading all of them in a fixed number of queries
+    if missing_documents:
+        query_result = Title.query.options(*Title.load_options()) \
+            .filter(Title.title_number.in_(missing_documents)).all()
+        for item in query_result:
+            documents[item.title_number] = repr(item)
+
+    # Output, the documents are already JSON so are joined into the map rather than decoded and encoded again
+    result = ','.join('{}:{}'.format(dumps(title_number), 'null' if document is None else document)
+                      for title_number, document in sorted(documents.items()))
+    return json_text_response('{' + result + '}')
 
 
 @title_v1.route("/titles/<string:title_number>", methods=["PUT"])
@@ -94,13 +240,10 @@ def update_title(title_number):
     current_app.logger.info('Starting update_title: {}'.format(title_number))
 
     # Validate input
-    try:
-        validate(title_request, title_request_schema, format_checker=FormatChecker(), resolver=ref_resolver)
-    except ValidationError as e:
-        raise ApplicationError(e.message, "E001", 400)
+    validate_request('TitleRequest', title_request)
 
     # Get the existing title
-    title = Title.query.get(title_number)
+    title = Title.query.options(*Title.load_options()).get(title_number)
 
     # Check that the title exists
     if not title:
@@ -110,118 +253,60 @@ def update_title(title_number):
     if not (title.title_number == title_number):
         raise ApplicationError('Title Number mismatch.', 'E004', 400)
 
-    # Check that the title isn't locked
-    if title.lock and title.lock > datetime.utcnow():
-        raise ApplicationError("Title is locked until " + str(title.lock), "E403", 403)
+    # With If-Match the title is only updated if it is still the version the client has
+    if precondition_failed(version_etag(title.version)):
+        raise ApplicationError("The title has been changed since it was read.", 'E412', 412)
 
-    # Modify title
-    title.updated_at = datetime.utcnow()
+    # The title's UPDATE is conditional on the version it was read at, so if another request changes it in the
+    # meantime this one fails rather than overwriting it
+    try:
+        documents = apply_title_request(title, title_request)
+        db.session.flush()
+        etag = version_etag(title.version)
+        db.session.commit()
+    except exc.IntegrityError:
+        raise ApplicationError("Failed to commit.", 'E003', 409)
+    except StaleDataError:
+        if request.if_match:
+            raise ApplicationError("The title has been changed since it was read.", 'E412', 412)
+        raise ApplicationError("The title was changed by another request.", 'E409', 409)
 
-    # Modify restrictions
-    restrictions_search_list_dict = {}
-    restrictions_search_list = {}
-    for restriction in title.restrictions:
-        restriction_dict = restriction.as_dict()
-        restrictions_search_list_id = ''.join([
-            restriction_dict['restriction_type'],
-            restriction_dict['restriction_id'],
-            restriction_dict['date']
-        ])
-        restrictions_search_list_dict[restrictions_search_list_id] = restriction_dict
-        restrictions_search_list[restrictions_search_list_id] = restriction
-
-    for new_restriction in title_request['restrictions']:
-        if Restriction.from_dict(new_restriction, title_number).as_dict() in restrictions_search_list.values():
-            # It exists!
-            # Remove from search list
-            restrictions_search_list_id = ''.join([
-                new_restriction['restriction_type'],
-                new_restriction['restriction_id'],
-                new_restriction['date']
-            ])
-            del restrictions_search_list_dict[restrictions_search_list_id]
-            del restrictions_search_list[restrictions_search_list_id]
-        else:
-            charge = None
-            if 'charge' in new_restriction:
-                # Add new charge for restriction
-                charge = Charge(
-                    new_restriction['charge']['date'],
-                    new_restriction['charge']['lender'],
-                    new_restriction['charge']['amount'],
-                    new_restriction['charge']['amount_currency_code'],
-                    title_number
-                )
-
-                db.session.add(charge)
-
-            # Add new restriction
-            restriction = Restriction(
-                new_restriction['date'],
-                new_restriction['restriction_id'],
-                new_restriction['restriction_type'],
-                new_restriction['restriction_text'],
-                new_restriction['consenting_party'],
-                title_number
-            )
-            if 'charge' in new_restriction:
-                restriction.charge = charge
-
-            db.session.add(restriction)
-
-    # Remove old restrictions
-    for old_restriction in restrictions_search_list.values():
-        if old_restriction.charge:
-            title.charges.remove(old_restriction.charge)
-            db.session.delete(old_restriction.charge)
-        title.restrictions.remove(old_restriction)
-        db.session.delete(old_restriction)
-
-    # Modify charges
-    charges_search_list_dict = {}
-    charges_search_list = {}
-    for charge in title.charges:
-        if not charge.restriction:
-            charge_dict = charge.as_dict()
-            charges_search_list_id = ''.join([
-                charge_dict['lender_string'],
-                str(charge_dict['amount']),
-                charge_dict['amount_currency_code'],
-                charge_dict['date']
-            ])
-            charges_search_list_dict[charges_search_list_id] = charge_dict
-            charges_search_list[charges_search_list_id] = charge
-
-    for new_charge in title_request['charges']:
-        if Charge.from_dict(new_charge, title_number).as_dict() in charges_search_list.values():
-            # It exists!
-            # Remove from search list
-            charges_search_list_id = ''.join([
-                new_charge['lender_string'],
-                str(new_charge['amount']),
-                new_charge['amount_currency_code'],
-                new_charge['date']
-            ])
-            del charges_search_list_dict[charges_search_list_id]
-            del charges_search_list[charges_search_list_id]
-        else:
-            # Add new charge
-            charge = Charge(
-                new_charge['date'],
-                new_charge['lender'],
-                new_charge['amount'],
-                new_charge['amount_currency_code'],
-                title_number
-            )
-            db.session.add(charge)
+    return json_text_response(documents[title_number], etag=etag)
 
-    # Remove old charges
-    for old_charge in charges_search_list.values():
-        title.charges.remove(old_charge)
-        db.session.delete(old_charge)
+
+def requested_fields():
+    """Get and check the `fields` query parameter, None if the client did not ask for a subset of the title."""
+    fields = request.args.get('fields')
+    if fields is None:
+        return None
+
+    fields = fields.split(',')
+    for field in fields:
+        if field not in title_fields:
+            raise ApplicationError("`fields` must be a comma separated list of: {}.".format(', '.join(title_fields)),
+                                   "E001", 400)
+    return fields
+
+
+def apply_title_request(title, title_request):
+    """Apply a validated TitleRequest to a loaded Title and flush the changes.
+
+    The stored documents of the title, and of any other titles whose document changed with it, are rebuilt in the
+    same transaction. Returns them by title number.
+    """
+    title_number = title.title_number
+
+    # Check that the title isn't locked, going by the database's clock as locking and unlocking do
+    if title.lock and Title.query.with_entities(Title.title_number) \
+            .filter(Title.title_number == title_number, Title.lock > database_utc_now()).first():
+        raise ApplicationError("Title is locked until " + str(title.lock), "E403", 403)
+
+    # Modify restrictions and charges
+    changed = reconcile_restrictions_and_charges(title, title_request)
 
     # Modify owner
     # Check if the owner id has changed, and if so check whether the new owner id exists
+    owner_updated = False
     if not title_request['owner']['identity'] == title.owner.identity:
         owner = Owner.query.get(title_request['owner']['identity'])
         # Check if the new owner already exists, and if not create them
@@ -266,66 +351,125 @@ def update_title(title_number):
         owner.owner_type = title_request['owner']['type']
         owner.address = owner_address
         db.session.add(owner)
+        owner_updated = db.session.is_modified(owner) or db.session.is_modified(owner_address)
 
-    if title_request.get('price_history'):
-        for price_request in title_request['price_history']:
-            price = PriceHistory(
-                title_number,
-                price_request['amount'],
-                price_request['currency_code'],
-                price_request['date'] if price_request.get('date') is not None else datetime.utcnow()
-            )
-            db.session.merge(price)
+    # Modify price history
+    prices_changed = upsert_price_history(title, title_request.get('price_history', []))
 
-    db.session.add(title)
+    # An unchanged title is left as it is, without writing anything
+    changed = changed or prices_changed or bool(db.session.new) or \
+        any(db.session.is_modified(item) for item in db.session.dirty)
+    if not changed:
+        return {title_number: title.document if title.document is not None else repr(title)}
 
-    try:
-        db.session.commit()
-    except exc.IntegrityError:
-        raise ApplicationError("Failed to commit.", 'E003', 409)
+    # Modify title
+    title.updated_at = datetime.utcnow()
+    db.session.add(title)
+    db.session.flush()
+
+    # Rebuild the stored documents in the same transaction. The owner's details are part of the document of
+    # each of their titles, so if they were modified all of those are rebuilt too. The collections that were written
+    # without the ORM have been expired, so they are loaded again here. Loaded rows aren't repopulated, as that
+    # would leave each standalone charge's restriction to be lazy loaded on its own.
+    if owner_updated:
+        updated_titles = Title.query.filter_by(owner=title.owner)
+    else:
+        updated_titles = Title.query.filter_by(title_number=title_number)
+    documents = {}
+    for updated_title in updated_titles.options(*Title.load_options()).all():
+        documents[updated_title.title_number] = updated_title.build_document()
 
-    return Response(response=repr(title), mimetype='application/json', status=200)
+    return documents
 
 
 @title_v1.route("/titles/<string:title_number>/lock", methods=["PUT"])
 @produces("application/json")
+@counts_lock_outcome('lock')
 def lock_title(title_number):
     """Lock a Title for a given title_number."""
     current_app.logger.info('Starting lock_title: {}'.format(title_number))
 
-    title = Title.query.get(title_number)
-
-    if not title:
-        raise ApplicationError("A title with the specified title number was not found.", 'E404', 404)
+    # Taken in a single conditional statement, going by the database's clock, so only one request can get the lock
+    result = set_title_lock(title_number, or_(Title.lock.is_(None), Title.lock < database_utc_now()),
+                            database_utc_now(days=days_to_lock_title_for))
 
-    if title.lock and title.lock > datetime.utcnow():
+    if not result:
+        check_title_exists(title_number)
         raise ApplicationError("The title is already locked.", 'E409', 409)
 
-    title.lock = (datetime.utcnow() + timedelta(days=days_to_lock_title_for)).isoformat()
-
-    db.session.add(title)
+    document, version = store_locked_document(title_number, result)
     db.session.commit()
 
-    return Response(response=repr(title), mimetype='application/json', status=200)
+    return json_text_response(document, etag=version_etag(version))
 
 
 @title_v1.route("/titles/<string:title_number>/unlock", methods=["PUT"])
 @produces("application/json")
+@counts_lock_outcome('unlock')
 def unlock_title(title_number):
     """Unlock a Title for a given title_number."""
     current_app.logger.info('Starting unlock_title: {}'.format(title_number))
 
-    title = Title.query.get(title_number)
-
-    if not title:
-        raise ApplicationError("A title with the specified title number was not found.", 'E404', 404)
+    result = set_title_lock(title_number, Title.lock.isnot(None), None)
 
-    if not title.lock:
+    if not result:
+        check_title_exists(title_number)
         raise ApplicationError("The title is already unlocked.", 'E409', 409)
 
-    title.lock = None
-
-    db.session.add(title)
+    document, version = store_locked_document(title_number, result)
     db.session.commit()
 
-    return Response(response=repr(title), mimetype='application/json', status=200)
+    return json_text_response(document, etag=version_etag(version))
+
+
+def database_utc_now(days=0):
+    """SQL expression for the database's current UTC time, plus a number of days, as naive UTC is what is stored."""
+    if db.engine.dialect.name == 'postgresql':
+        now = func.timezone('utc', func.now())
+        return now + timedelta(days=days) if days else now
+    # SQLite, whose clock is already UTC
+    return func.datetime('now', '+{} days'.format(days)) if days else func.datetime('now')
+
+
+def set_title_lock(title_number, condition, lock):
+    """Set the lock of a title with a single UPDATE, if the condition holds for it.
+
+    Returns the title's new lock, stored document and version, or None if the title doesn't exist or the condition
+    doesn't hold.
+    """
+    title_table = Title.__table__
+    statement = title_table.update() \
+        .where(and_(title_table.c.title_number == title_number, condition)) \
+        .values(lock=lock, version=title_table.c.version + 1)
+
+    # PostgreSQL returns the columns from the UPDATE itself, elsewhere they are read back in the same transaction
+    if db.engine.dialect.name == 'postgresql':
+        return db.session.execute(statement.returning(title_table.c.lock, title_table.c.document,
+                                                      title_table.c.version)).first()
+    if not db.session.execute(statement).rowcount:
+        return None
+    return Title.query.with_entities(Title.lock, Title.document, Title.version) \
+        .filter_by(title_number=title_number).first()
+
+
+def store_locked_document(title_number, result):
+    """Store the document of a title whose lock has just been set, returning it and the title's version.
+
+    The lock is all that changed, so a stored document just has its locked_at replaced. Titles without one have it
+    built from the whole title.
+    """
+    if result.document is None:
+        title = Title.query.options(*Title.load_options()).get(title_number)
+        document = title.build_document()
+        db.session.flush()
+        return document, title.version
+
+    document = Title.document_with_lock(result.document, result.lock)
+    Title.query.filter_by(title_number=title_number).update({'document': document}, synchronize_session=False)
+    return document, result.version
+
+
+def check_title_exists(title_number):
+    """Raise a not found error if there is no title with the title number."""
+    if not Title.query.with_entities(Title.title_number).filter_by(title_number=title_number).first():
+        raise ApplicationError("A title with the specified title number was not found.", 'E404', 404)
@@ -24,7 +24,7 @@ class TestConveyancer(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_001_happy_path_get_conveyancers(self, mock_db_query):
         """Gets a list of all conveyancers."""
-        mock_db_query.all.return_value = [conveyancer]
+        mock_db_query.order_by.return_value.all.return_value = [conveyancer]
         resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json'})
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(len(resp.json), 1)
@@ -37,3 +37,56 @@ class TestConveyancer(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json['x500'], conveyancer_x500_dict)
         self.assertEqual(resp.json['company_name'], "ConveyIt")
+
+    @mock.patch.object(db.Model, 'query')
+    def test_003_happy_path_get_conveyancers_not_modified(self, mock_db_query):
+        """Gets the list of conveyancers when the client already holds the current version."""
+        mock_db_query.order_by.return_value.all.return_value = [conveyancer]
+        resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+
+        with mock.patch.object(Conveyancer, 'as_dict') as mock_as_dict:
+            resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json',
+                                                             'If-None-Match': resp.headers['ETag']})
+            self.assertFalse(mock_as_dict.called)
+        self.assertEqual(resp.status_code, 304)
+
+        other_conveyancer = Conveyancer("O=Conveyancer2,L=Plymouth,C=GB", "Propertylaw.net")
+        mock_db_query.order_by.return_value.all.return_value = [conveyancer, other_conveyancer]
+        resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json',
+                                                         'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json), 2)
+
+    @mock.patch.object(db.Model, 'query')
+    def test_004_happy_path_get_conveyancers_paginated(self, mock_db_query):
+        """Gets the first page of conveyancers."""
+        first_conveyancer = Conveyancer("O=Conveyancer1,L=Plymouth,C=GB", "ConveyIt")
+        first_conveyancer.conveyancer_id = 1
+        other_conveyancer = Conveyancer("O=Conveyancer2,L=Plymouth,C=GB", "Propertylaw.net")
+        other_conveyancer.conveyancer_id = 2
+        mock_db_query.order_by.return_value.limit.return_value.all.return_value = \
+            [first_conveyancer, other_conveyancer]
+        resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json'}, query_string={'limit': 1})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json), 1)
+        mock_db_query.order_by.return_value.limit.assert_called_with(2)
+
+        mock_db_query.filter.return_value.order_by.return_value.limit.return_value.all.return_value = \
+            [other_conveyancer]
+        resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json'},
+                            query_string={'limit': 1, 'next': resp.headers['X-Next-Cursor']})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json[0]['conveyancer_id'], 2)
+        self.assertNotIn('X-Next-Cursor', resp.headers)
+
+    @mock.patch.object(db.Model, 'query')
+    def test_005_happy_path_get_conveyancers_streamed(self, mock_db_query):
+        """Streams the list of all conveyancers."""
+        mock_db_query.order_by.return_value.yield_per.return_value = [conveyancer, conveyancer]
+        resp = self.app.get('/v1/conveyancers', headers={'accept': 'application/json'},
+                            query_string={'stream': 'true'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.is_streamed)
+        self.assertEqual(len(resp.json), 2)
+        self.assertEqual(resp.json[0]['company_name'], "ConveyIt")
@@ -0,0 +1,136 @@
+from unittest import TestCase, mock
+import io
+import json
+import logging
+import queue
+import socket
+import threading
+import time
+
+import requests
+from flask import g
+from title_api.custom_extensions.enhanced_logging.filters import ContextualFilter
+from title_api.custom_extensions.enhanced_logging.formatters import JsonFormatter
+from title_api.custom_extensions.enhanced_logging.handlers import DroppingQueueHandler, queue_handler
+from title_api.custom_extensions.enhanced_logging.main import create_requests_session
+from title_api.extensions import enhanced_logging
+from title_api.main import app
+
+
+class TestEnhancedLogging(TestCase):
+
+    def setUp(self):
+        self.requests_patch = mock.patch.object(enhanced_logging, '_requests', None)
+        self.requests_patch.start()
+
+    def tearDown(self):
+        self.requests_patch.stop()
+
+    def test_001_requests_session_created_lazily(self):
+        """Handling a request that makes no outbound calls doesn't create a requests session."""
+        resp = app.test_client().get('/health')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(enhanced_logging._requests)
+
+    def test_002_requests_session_shared(self):
+        """Every request gets the same pooled session, with retries."""
+        with app.test_request_context():
+            session = enhanced_logging.requests
+        with app.test_request_context():
+            self.assertIs(enhanced_logging.requests, session)
+
+        adapter = session.get_adapter('http://title-api/')
+        self.assertEqual(adapter.max_retries.total, app.config['OUTBOUND_RETRIES'])
+        # A read that times out isn't retried, so a call can't take several times its timeout
+        self.assertEqual(adapter.max_retries.read, 0)
+        self.assertFalse(adapter.max_retries.respect_retry_after_header)
+        self.assertEqual(adapter._pool_maxsize, app.config['OUTBOUND_POOL_MAXSIZE'])
+        self.assertIs(session.get_adapter('https://title-api/'), adapter)
+
+    @mock.patch.object(requests.Session, 'request')
+    def test_003_trace_id_added_per_call(self, mock_request):
+        """Each call carries the trace id of the request making it, and the default timeout."""
+        for trace_id in ['trace1', 'trace2']:
+            with app.test_request_context(headers={'X-Trace-ID': trace_id}):
+                app.preprocess_request()
+                self.assertEqual(g.trace_id, trace_id)
+                enhanced_logging.requests.get('http://title-api/health', headers={'Accept': 'application/json'})
+            self.assertEqual(mock_request.call_args[1]['headers'],
+                             {'Accept': 'application/json', 'X-Trace-ID': trace_id})
+            self.assertEqual(mock_request.call_args[1]['timeout'], app.config['DEFAULT_TIMEOUT'])
+        self.assertNotIn('X-Trace-ID', enhanced_logging.requests.headers)
+
+    def test_004_queue_handler_drops_and_counts(self):
+        """Records that don't fit on the queue are dropped and counted, and the drop is reported once there is room."""
+        handler = DroppingQueueHandler(queue.Queue(2))
+        logger = logging.getLogger('test_queue_handler_drops')
+        logger.addHandler(handler)
+        logger.propagate = False
+        for i in range(5):
+            logger.warning("Record %s", i)
+        self.assertEqual(handler.dropped, 3)
+        self.assertEqual([handler.queue.get_nowait().msg for _ in range(2)], ["Record 0", "Record 1"])
+
+        logger.warning("Record 5")
+        self.assertEqual([handler.queue.get_nowait().msg for _ in range(2)],
+                         ["Dropped 3 log records as the log queue was full", "Record 5"])
+        self.assertEqual(handler.dropped, 3)
+
+    def test_005_queue_handler_flushes_on_stop(self):
+        """Queued records are formatted and written by the listener, which writes all of them before it stops."""
+        stream = io.StringIO()
+        handler = queue_handler(100, stream)
+        handler.addFilter(ContextualFilter())
+        logger = logging.getLogger('test_queue_handler_flushes')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        with app.test_request_context(headers={'X-Trace-ID': 'trace1'}):
+            app.preprocess_request()
+            for i in range(50):
+                logger.info("Record %s", i)
+            try:
+                raise ValueError("Bad value")
+            except ValueError:
+                logger.exception("Failed")
+        handler.listener.stop()
+
+        lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+        self.assertEqual([line['message'] for line in lines], ["Record {}".format(i) for i in range(50)] + ["Failed"])
+        self.assertTrue(all(line['traceid'] == 'trace1' for line in lines))
+        self.assertIn("ValueError: Bad value\n", lines[-1]['exception'])
+
+    def test_006_formatter_timings(self):
+        """Timings logged with a record are a field of its JSON log line, which other lines don't have."""
+        record = logging.makeLogRecord({'msg': "Timings of GET /v1/titles", 'trace_id': 'trace1'})
+        self.assertNotIn('timings', json.loads(JsonFormatter().format(record)))
+        record.timings = {"sql": 1.5, "total": 2.25}
+        line = json.loads(JsonFormatter().format(record))
+        self.assertEqual((line['traceid'], line['timings']), ('trace1', {"sql": 1.5, "total": 2.25}))
+
+    def test_007_read_timeout_not_retried(self):
+        """A call to a service that accepts the connection but never answers fails after one timeout."""
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(5)
+        connections = []
+
+        def accept():
+            while True:
+                try:
+                    connections.append(server.accept()[0])
+                except OSError:
+                    return
+        threading.Thread(target=accept, daemon=True).start()
+
+        session = create_requests_session(dict(app.config, OUTBOUND_RETRIES=2, OUTBOUND_RETRY_BACKOFF=0))
+        started = time.monotonic()
+        try:
+            with self.assertRaises(requests.exceptions.RequestException):
+                session.get('http://127.0.0.1:{}/health'.format(server.getsockname()[1]), timeout=0.3)
+            self.assertLess(time.monotonic() - started, 0.6)
+            self.assertEqual(len(connections), 1)
+        finally:
+            server.close()
+            for connection in connections:
+                connection.close()
@@ -0,0 +1,22 @@
+import os
+import tempfile
+from unittest import TestCase, mock
+
+import gunicorn_config
+
+
+class TestGunicornConfig(TestCase):
+
+    def test_001_on_starting_empties_metrics_directory(self):
+        """Metrics left in the directory by the workers of an earlier run are removed when the app starts."""
+        with tempfile.TemporaryDirectory() as directory:
+            for name in ['counter_10.db', 'gauge_livesum_11.db']:
+                open(os.path.join(directory, name), 'w').close()
+            with mock.patch.dict(os.environ, {'prometheus_multiproc_dir': directory}):
+                gunicorn_config.on_starting(mock.Mock())
+            self.assertEqual(os.listdir(directory), [])
+
+    @mock.patch.object(gunicorn_config.multiprocess, 'mark_process_dead')
+    def test_002_child_exit_marks_worker_dead(self, mock_mark_process_dead):
+        gunicorn_config.child_exit(mock.Mock(), mock.Mock(pid=1234))
+        mock_mark_process_dead.assert_called_once_with(1234)
@@ -1,7 +1,6 @@
 from unittest import TestCase
 from title_api.main import app
 from title_api.models import X500Name
-import copy
 
 # Test data
 standard_string1 = "CN=Generic Conveyancing Company, OU=Digital, O=Generic Conveyancing Company, \
@@ -54,9 +53,8 @@ class TestModelX500Name(TestCase):
         x500name = X500Name('Generic Conveyancing Company', 'Plymouth', 'GB')
         self.compare_against_standard(x500name, False, False, False)
 
-        x500name.state = 'Devon'
-        x500name.organisational_unit = 'Digital'
-        x500name.common_name = 'Generic Conveyancing Company'
+        x500name = X500Name('Generic Conveyancing Company', 'Plymouth', 'GB', 'Devon', 'Digital',
+                            'Generic Conveyancing Company')
         self.compare_against_standard(x500name)
 
     def test_002_x500name_init_missing_val(self):
@@ -120,20 +118,17 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(TypeError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = None
+            x = x500name.replace(organisation=None)
             x.validate()
         self.assertIn('Missing: organisation', str(e.exception))
 
         with self.assertRaises(TypeError) as e:
-            x = copy.deepcopy(x500name)
-            x.locality = None
+            x = x500name.replace(locality=None)
             x.validate()
         self.assertIn('Missing: locality', str(e.exception))
 
         with self.assertRaises(TypeError) as e:
-            x = copy.deepcopy(x500name)
-            x.country = None
+            x = x500name.replace(country=None)
             x.validate()
         self.assertIn('Missing: country', str(e.exception))
 
@@ -142,74 +137,62 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'A'
+            x = x500name.replace(organisation='A')
             x.validate()
         self.assertIn('Wrong length: organisation', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'A' * 129
+            x = x500name.replace(organisation='A' * 129)
             x.validate()
         self.assertIn('Wrong length: organisation', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.locality = 'A'
+            x = x500name.replace(locality='A')
             x.validate()
         self.assertIn('Wrong length: locality', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.locality = 'A' * 65
+            x = x500name.replace(locality='A' * 65)
             x.validate()
         self.assertIn('Wrong length: locality', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.country = 'A'
+            x = x500name.replace(country='A')
             x.validate()
         self.assertIn('Wrong length: country', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.country = 'A' * 3
+            x = x500name.replace(country='A' * 3)
             x.validate()
         self.assertIn('Wrong length: country', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.state = 'A'
+            x = x500name.replace(state='A')
             x.validate()
         self.assertIn('Wrong length: state', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.state = 'A' * 65
+            x = x500name.replace(state='A' * 65)
             x.validate()
         self.assertIn('Wrong length: state', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisational_unit = 'A'
+            x = x500name.replace(organisational_unit='A')
             x.validate()
         self.assertIn('Wrong length: organisational_unit', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisational_unit = 'A' * 65
+            x = x500name.replace(organisational_unit='A' * 65)
             x.validate()
         self.assertIn('Wrong length: organisational_unit', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.common_name = 'A'
+            x = x500name.replace(common_name='A')
             x.validate()
         self.assertIn('Wrong length: common_name', str(e.exception))
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.common_name = 'A' * 65
+            x = x500name.replace(common_name='A' * 65)
             x.validate()
         self.assertIn('Wrong length: common_name', str(e.exception))
 
@@ -218,8 +201,7 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'conveyIt'
+            x = x500name.replace(organisation='conveyIt')
             x.validate()
         self.assertIn('First character is not uppercase: organisation', str(e.exception))
 
@@ -228,8 +210,7 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'Generic Conveyancing Company '
+            x = x500name.replace(organisation='Generic Conveyancing Company ')
             x.validate()
         self.assertIn('Has leading or trailing whitespace: organisation', str(e.exception))
 
@@ -238,8 +219,7 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'It, \'Convey\' = \"-$\"'
+            x = x500name.replace(organisation='It, \'Convey\' = \"-$\"')
             x.validate()
         self.assertIn('Contains invalid characters: organisation', str(e.exception))
 
@@ -248,8 +228,7 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_dict(standard_dict1)
 
         with self.assertRaises(ValueError) as e:
-            x = copy.deepcopy(x500name)
-            x.organisation = 'Generic Conveyancing Company\00'
+            x = x500name.replace(organisation='Generic Conveyancing Company\00')
             x.validate()
         self.assertIn('Contains null character: organisation', str(e.exception))
 
@@ -268,6 +247,25 @@ class TestModelX500Name(TestCase):
         x500name = X500Name.from_string(standard_string1)
         self.compare_dict_against_standard(x500name.as_dict())
 
+    def test_018_x500name_immutable(self):
+        """X500Names cannot be modified once created."""
+        x500name = X500Name.from_dict(standard_dict1)
+
+        with self.assertRaises(AttributeError):
+            x500name.organisation = 'Conveyit'
+        with self.assertRaises(AttributeError):
+            x500name.extra = 'Conveyit'
+        self.assertEqual(x500name.organisation, 'Generic Conveyancing Company')
+
+    def test_019_x500name_interned(self):
+        """Parsing the same name again returns the cached, equal instance."""
+        x500name = X500Name.from_string(standard_string2)
+        self.assertIs(X500Name.from_string(standard_string2), x500name)
+        self.assertIs(X500Name.from_dict(standard_dict1), x500name)
+        self.assertEqual(X500Name.from_string(standard_string1), x500name)
+        self.assertEqual(hash(X500Name.from_string(standard_string1)), hash(x500name))
+        self.assertNotEqual(X500Name.from_string(standard_string3), x500name)
+
     def compare_against_standard(self, x500name, is_s_set=True, is_ou_set=True, is_cn_set=True):
         """Checks if the X500Name contains the correct values for the test data at the top of the file."""
         self.assertEqual(x500name.organisation, 'Generic Conveyancing Company')
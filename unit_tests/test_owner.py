@@ -39,3 +39,18 @@ class TestOwner(TestCase):
                             query_string={'email_address': "wrong.email@example.com"})
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json, [])
+
+    @mock.patch.object(db.Model, 'query')
+    def test_004_happy_path_get_owner_not_modified(self, mock_db_query):
+        """Gets an owner the client already holds the current version of."""
+        mock_db_query.filter_by.return_value.first.return_value = owner
+        resp = self.app.get('/v1/owners', headers={'accept': 'application/json'},
+                            query_string={'email_address': "lisa.seller@example.com"})
+        self.assertEqual(resp.status_code, 200)
+
+        with mock.patch.object(Owner, 'as_dict') as mock_as_dict:
+            resp = self.app.get('/v1/owners', headers={'accept': 'application/json',
+                                                       'If-None-Match': resp.headers['ETag']},
+                                query_string={'email_address': "lisa.seller@example.com"})
+            self.assertFalse(mock_as_dict.called)
+        self.assertEqual(resp.status_code, 304)
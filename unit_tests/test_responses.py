@@ -0,0 +1,79 @@
+from unittest import TestCase, mock, skipIf
+from title_api import responses
+from title_api.models import Title, Owner, Address, Restriction, Charge, PriceHistory
+from datetime import date, datetime
+import json
+
+owner_address = Address("1", "Digital Street", "Bristol", "Avon", "England", "BS2 8EN")
+owner = Owner(1, "Zoë", "Brontë", "zoe.seller@example.com", "07123456780", 'individual', owner_address)
+title = Title("RTV100000", owner, Address("2", "Straße", "Bristol", "Avon", "England", "BS2 8EN"))
+title.lock = datetime(2019, 3, 1, 12, 30, 15, 123456)
+title.updated_at = datetime(2019, 2, 1)
+restriction = Restriction(None, "RTV", "ORES", "Restriction text ✓", "O=Conveyancer1,L=Plymouth,C=GB", "RTV100000")
+restriction.charge = Charge(None, "O=Lender1,L=Plymouth,C=GB", 150000.5, "GBP", "RTV100000")
+title.restrictions.append(restriction)
+title.charges.append(restriction.charge)
+for amount in [0.1, 1e-05, 1e16, 12345678901234567890.0, -0.0]:
+    title.charges.append(Charge(None, "O=Lender2,L=Plymouth,C=GB", amount, "GBP", "RTV100000"))
+title.price_history.append(PriceHistory("RTV100000", 100000, "GBP", datetime(2018, 1, 1)))
+
+payloads = [
+    {"b": 1, "a": [1.5, None, True, "text"], "c": {"z": 2 ** 70, "y": date(2019, 1, 1)}},
+    [datetime(2019, 1, 1, 0, 0, 0, 1), 1e-4, 9.99e-5, -1e22, 3.0, "\"quoted\" \\ \n", "naïve"],
+    {"error_message": "Not Found", "error_code": "404"},
+    "RTV100000",
+    {"a": "del \x7f"},
+    0.00001,
+    {"a": [float('nan'), None], "b": float('inf'), "c": -float('inf')},
+    float('nan')
+]
+
+
+def legacy_dumps(obj, sort_keys=True):
+    """The encoding used before the responses module, with dates converted by isoformat beforehand."""
+    def isoformat(value):
+        if isinstance(value, dict):
+            return {key: isoformat(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [isoformat(item) for item in value]
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        return value
+    return json.dumps(isoformat(obj), sort_keys=sort_keys, separators=(',', ':'))
+
+
+class TestResponses(TestCase):
+
+    def check_encoder(self, name):
+        """Checks an encoder gives byte-identical output to the legacy encoding."""
+        encoder = responses.encoders[name]
+        for payload in payloads:
+            self.assertEqual(encoder(payload), legacy_dumps(payload))
+            self.assertEqual(encoder(payload, sort_keys=False), legacy_dumps(payload, sort_keys=False))
+
+        with mock.patch.object(responses, 'encoder', encoder):
+            self.assertEqual(repr(title), legacy_dumps(title.as_dict()))
+            self.assertEqual(repr(owner), legacy_dumps(owner.as_dict()))
+
+    def test_001_stdlib_encoder(self):
+        """The standard library encoder matches the legacy encoding."""
+        self.check_encoder('json')
+
+    @skipIf(responses.orjson is None, "orjson is not installed")
+    def test_002_orjson_encoder(self):
+        """The orjson encoder matches the legacy encoding, falling back where orjson would differ."""
+        self.check_encoder('orjson')
+        self.assertIs(responses.encoder, responses.encoders['orjson'])
+
+    def test_003_use_encoder(self):
+        """The encoder used by dumps can be switched."""
+        default_encoder = responses.encoder
+        try:
+            responses.use_encoder('json')
+            self.assertIs(responses.encoder, responses.stdlib_dumps)
+            self.assertEqual(responses.dumps({"b": 1, "a": 2}), '{"a":2,"b":1}')
+        finally:
+            responses.encoder = default_encoder
+
+        with self.assertRaises(TypeError):
+            responses.dumps({"a": object()})
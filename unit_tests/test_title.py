@@ -31,8 +31,8 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_001_happy_path_get_titles_by_email_address(self, mock_db_query):
         """Gets a list of titles by owner's email address."""
-        mock_db_query.filter_by.return_value.first.return_value = owner
-        mock_db_query.filter_by.return_value.all.return_value = [title]
+        mock_db_query.options.return_value.join.return_value.filter.return_value.order_by.return_value.all \
+            .return_value = [title]
         resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
                             query_string={'owner_email_address': owner_request['email_address']})
         self.assertEqual(resp.status_code, 200)
@@ -42,8 +42,8 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_002_happy_path_get_titles_by_identity(self, mock_db_query):
         """Gets a list of titles by owner's identity."""
-        mock_db_query.filter_by.return_value.first.return_value = owner
-        mock_db_query.filter_by.return_value.all.return_value = [title]
+        mock_db_query.options.return_value.join.return_value.filter.return_value.order_by.return_value.all \
+            .return_value = [title]
         resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
                             query_string={'owner_identity': owner_request['identity']})
         self.assertEqual(resp.status_code, 200)
@@ -53,8 +53,8 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_003_happy_path_get_titles_by_email_address_and_address(self, mock_db_query):
         """Gets a list of titles by owner's email address."""
-        mock_db_query.filter_by.return_value.first.return_value = owner
-        mock_db_query.filter_by.return_value.filter_by.return_value.all.return_value = [title]
+        mock_db_query.options.return_value.join.return_value.filter.return_value.join.return_value.filter \
+            .return_value.order_by.return_value.limit.return_value.all.return_value = [title]
         resp = self.app.get('/v1/titles',
                             headers={'accept': 'application/json'},
                             query_string={
@@ -69,8 +69,8 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_004_happy_path_get_titles_by_identity_and_address(self, mock_db_query):
         """Gets a list of titles by owner's identity."""
-        mock_db_query.filter_by.return_value.first.return_value = owner
-        mock_db_query.filter_by.return_value.filter_by.return_value.all.return_value = [title]
+        mock_db_query.options.return_value.join.return_value.filter.return_value.join.return_value.filter \
+            .return_value.order_by.return_value.limit.return_value.all.return_value = [title]
         resp = self.app.get('/v1/titles',
                             headers={'accept': 'application/json'},
                             query_string={
@@ -113,7 +113,8 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_008_happy_path_get_title_by_title_number(self, mock_db_query):
         """Gets a title with the specified title_number."""
-        mock_db_query.get.return_value = title
+        mock_db_query.with_entities.return_value.filter_by.return_value.first.return_value = \
+            mock.Mock(document=repr(title), version=1)
         resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json'})
         self.assertEqual(resp.status_code, 200)
         self.assertEqual(resp.json['owner']['email_address'], "lisa.seller@example.com")
@@ -122,7 +123,7 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_009_unhappy_path_get_title_doesnt_exist(self, mock_db_query):
         """The given title number doesn't exist."""
-        mock_db_query.get.return_value = None
+        mock_db_query.with_entities.return_value.filter_by.return_value.first.return_value = None
         resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json'})
         self.assertEqual(resp.status_code, 404)
         self.assertEqual(resp.json['error_message'], "A title with the specified title number was not found.")
@@ -132,7 +133,7 @@ class TestTitle(TestCase):
     @mock.patch.object(db.Model, 'query')
     def test_010_happy_path_update_title(self, mock_db_query, mock_db_add, mock_db_commit):
         """Updates the details of a title."""
-        mock_db_query.get.return_value = title
+        mock_db_query.options.return_value.get.return_value = title
         resp = self.app.put('/v1/titles/RTV237250', data=json.dumps(title_request),
                             headers={'accept': 'application/json', 'content-type': 'application/json'})
         self.assertEqual(resp.status_code, 200)
@@ -140,3 +141,31 @@ class TestTitle(TestCase):
         self.assertTrue(mock_db_commit.called)
         # check that the created date has been set
         assert json.loads(resp.get_data().decode())['updated_at'] is not None
+
+    @mock.patch.object(db.Model, 'query')
+    def test_011_happy_path_get_title_without_document(self, mock_db_query):
+        """Gets a title that has no stored document yet."""
+        mock_db_query.with_entities.return_value.filter_by.return_value.first.return_value = \
+            mock.Mock(document=None, version=1)
+        mock_db_query.options.return_value.get.return_value = title
+        resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.get_data().decode(), repr(title))
+
+    @mock.patch.object(db.Model, 'query')
+    def test_012_happy_path_get_title_not_modified(self, mock_db_query):
+        """Gets a title the client already holds the current version of."""
+        mock_db_query.with_entities.return_value.filter_by.return_value.first.return_value = \
+            mock.Mock(document=repr(title), version=1)
+        resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+        self.assertEqual(etag, '"1"')
+
+        resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json', 'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+        self.assertEqual(resp.get_data(), b'')
+
+        resp = self.app.get('/v1/titles/RTV237250', headers={'accept': 'application/json', 'If-None-Match': '"abc"'})
+        self.assertEqual(resp.status_code, 200)
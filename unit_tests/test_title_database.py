@@ -0,0 +1,887 @@
+from unittest import TestCase, mock
+from prometheus_client import REGISTRY
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine, event
+from title_api.main import app
+from title_api.extensions import db
+from title_api.models import Title, Owner, Address, Restriction, Charge, PriceHistory
+from title_api.custom_extensions.metrics.main import MeteredQueuePool
+from title_api.custom_extensions.server_timing import main as server_timing
+from title_api.views import title_v1
+from datetime import datetime, timedelta
+import json
+
+lender = "O=Lender1,L=Plymouth,C=GB"
+consenting_party = "O=Conveyancer1,L=Plymouth,C=GB"
+
+owner_request = {
+    "identity": "1",
+    "first_name": "Lisa",
+    "last_name": "Black",
+    "email_address": "lisa.seller@example.com",
+    "phone_number": "07123456780",
+    "type": "individual",
+    "address": {
+        "house_name_number": "1",
+        "street": "Digital Street",
+        "town_city": "Bristol",
+        "county": "Avon",
+        "country": "England",
+        "postcode": "BS2 8EN"
+    }
+}
+
+title_request = {
+    "owner": owner_request,
+    "charges": [],
+    "restrictions": [],
+    "price_history": [{"amount": 100000, "currency_code": "GBP"}]
+}
+
+
+def seller():
+    """The owner whose titles the tests add, a new instance for each test's session."""
+    return Owner("1", "Lisa", "White", "lisa.seller@example.com", "07123456780", 'individual',
+                 Address("1", "Digital Street", "Bristol", "Avon", "England", "BS2 8EN"))
+
+
+class TestTitleDatabase(TestCase):
+    """Runs the title read paths against an in-memory database and counts the SQL statements they issue."""
+
+    def setUp(self):
+        """Sets up the tests."""
+        # Requests that run more SQL statements than their route's budget fail
+        self.config_patch = mock.patch.dict(app.config, {'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+                                                         'SQL_STATEMENT_BUDGET_STRICT': True})
+        self.config_patch.start()
+        self.app = app.test_client()
+        self.app_context = app.app_context()
+        self.app_context.push()
+        db.create_all()
+        self.statements = []
+        event.listen(db.engine, 'before_cursor_execute', self.count_statement)
+
+    def tearDown(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count_statement)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        self.config_patch.stop()
+
+    def count_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def add_titles(self, count, owner):
+        """Adds titles with restrictions, charges and price history to the owner."""
+        for i in range(count):
+            title_number = "RTV{}".format(100000 + Title.query.count())
+            title = Title(title_number, owner, Address(str(i), "Digital Street", "Bristol", "Avon", "England",
+                                                       "BS2 8EN"))
+            db.session.add(title)
+            for j in range(2):
+                restriction = Restriction(None, "RTV", "ORES", "Restriction text", consenting_party, title_number)
+                restriction.charge = Charge(None, lender, 100 * j, "GBP", title_number)
+                title.restrictions.append(restriction)
+                title.charges.append(restriction.charge)
+                title.charges.append(Charge(None, lender, 200 * j, "GBP", title_number))
+                title.price_history.append(PriceHistory(title_number, 1000 * j, "GBP", datetime(2000 + j, 1, 1)))
+        db.session.commit()
+        db.session.expunge_all()
+
+    def count_get(self, url, query_string=None):
+        """Gets the url and returns how many SQL statements were issued."""
+        self.statements = []
+        resp = self.app.get(url, headers={'accept': 'application/json'}, query_string=query_string)
+        self.assertEqual(resp.status_code, 200)
+        db.session.remove()
+        return len(self.statements), resp.json
+
+    def test_001_get_titles_query_count(self):
+        """Getting an owner's titles issues the same number of queries however many titles they own."""
+        owner = seller()
+        self.add_titles(1, owner)
+        query_string = {'owner_email_address': "lisa.seller@example.com"}
+        single_count, results = self.count_get('/v1/titles', query_string)
+        self.assertEqual(len(results), 1)
+
+        self.add_titles(5, Owner.query.get("1"))
+        many_count, results = self.count_get('/v1/titles', query_string)
+        self.assertEqual(len(results), 6)
+        self.assertEqual(len(results[5]['restrictions']), 2)
+        self.assertEqual(len(results[5]['charges']), 2)
+        self.assertEqual(len(results[5]['price_history']), 2)
+
+        self.assertEqual(single_count, many_count)
+        self.assertLessEqual(many_count, 5)
+
+    def test_002_get_title_query_count(self):
+        """Getting a title without a stored document loads its whole aggregate in a fixed number of queries."""
+        owner = seller()
+        self.add_titles(1, owner)
+        count, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(len(result['restrictions']), 2)
+        self.assertIsNotNone(result['restrictions'][0]['charge'])
+        self.assertLessEqual(count, 5)
+
+    def test_003_get_title_from_document(self):
+        """Getting a title with a stored document only reads the document."""
+        owner = seller()
+        self.add_titles(1, owner)
+        _, expected = self.count_get('/v1/titles/RTV100000')
+
+        Title.query.get("RTV100000").build_document()
+        db.session.commit()
+        count, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(count, 1)
+        self.assertEqual(result, expected)
+
+    def test_004_lock_unlock_rebuild_document(self):
+        """Locking and unlocking a title rebuilds its stored document."""
+        owner = seller()
+        self.add_titles(1, owner)
+
+        resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(resp.json['locked_at'])
+        db.session.remove()
+        _, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(result, resp.json)
+
+        resp = self.app.put('/v1/titles/RTV100000/unlock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.json['locked_at'])
+        db.session.remove()
+        _, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(result, resp.json)
+
+    def test_005_update_title_rebuilds_owner_documents(self):
+        """Updating a title's owner rebuilds the stored document of each of the owner's titles."""
+        owner = seller()
+        self.add_titles(2, owner)
+
+        resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(title_request),
+                            headers={'accept': 'application/json', 'content-type': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['owner']['last_name'], "Black")
+        self.assertEqual(len(resp.json['restrictions']), 0)
+        db.session.remove()
+
+        _, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(result, resp.json)
+        count, result = self.count_get('/v1/titles/RTV100001')
+        self.assertEqual(count, 1)
+        self.assertEqual(result['owner']['last_name'], "Black")
+
+    def test_006_get_titles_paginated(self):
+        """Pages through an owner's titles with a limit and the next page cursor."""
+        owner = seller()
+        self.add_titles(5, owner)
+
+        title_numbers = []
+        pages = 0
+        query_string = {'owner_identity': "1", 'limit': 2}
+        while True:
+            resp = self.app.get('/v1/titles', headers={'accept': 'application/json'}, query_string=query_string)
+            self.assertEqual(resp.status_code, 200)
+            self.assertLessEqual(len(resp.json), 2)
+            title_numbers.extend(item['title_number'] for item in resp.json)
+            pages += 1
+            if 'X-Next-Cursor' not in resp.headers:
+                break
+            query_string['next'] = resp.headers['X-Next-Cursor']
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(title_numbers, ["RTV10000{}".format(i) for i in range(5)])
+
+    def test_007_get_titles_invalid_page_parameters(self):
+        """Rejects a bad limit or a tampered cursor."""
+        for query_string in [{'limit': 0}, {'limit': 'ten'}, {'limit': 1001}, {'next': 'not a cursor'},
+                             {'next': 'MTIz'}]:
+            query_string['owner_identity'] = "1"
+            resp = self.app.get('/v1/titles', headers={'accept': 'application/json'}, query_string=query_string)
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json['error_code'], "E001")
+
+    def test_008_get_titles_streamed(self):
+        """Streams all of an owner's titles, fetching them in batches."""
+        owner = seller()
+        self.add_titles(5, owner)
+        resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                            query_string={'owner_identity': "1"})
+        db.session.remove()
+
+        with mock.patch('title_api.streaming.stream_batch_size', 2):
+            streamed_resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                                         query_string={'owner_identity': "1", 'stream': 'true'})
+            self.assertTrue(streamed_resp.is_streamed)
+            chunks = list(streamed_resp.iter_encoded())
+            # Opening bracket, three batches of titles and the closing bracket
+            self.assertEqual(len(chunks), 5)
+            self.assertEqual(b''.join(chunks), resp.get_data())
+
+        resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                            query_string={'owner_identity': "1", 'stream': 'true', 'limit': 2})
+        self.assertEqual(resp.status_code, 400)
+
+    def test_009_lookup_titles(self):
+        """Gets many titles at once, with and without stored documents, in a fixed number of queries."""
+        owner = seller()
+        self.add_titles(4, owner)
+        Title.query.get("RTV100001").build_document()
+        db.session.commit()
+        db.session.remove()
+
+        title_numbers = ["RTV100000", "RTV100001", "RTV100002", "RTV100003", "RTV100009", "RTV100000"]
+        self.statements = []
+        resp = self.app.post('/v1/titles/lookup', data=json.dumps({"title_numbers": title_numbers}),
+                             headers={'accept': 'application/json', 'content-type': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertLessEqual(len(self.statements), 5)
+        db.session.remove()
+
+        self.assertEqual(sorted(resp.json), sorted(set(title_numbers)))
+        self.assertIsNone(resp.json["RTV100009"])
+        for title_number in ["RTV100000", "RTV100001", "RTV100002", "RTV100003"]:
+            _, result = self.count_get('/v1/titles/' + title_number)
+            self.assertEqual(resp.json[title_number], result)
+
+    def test_010_lookup_titles_invalid(self):
+        """Rejects a lookup with no or invalid title numbers."""
+        for lookup_request in [{}, {"title_numbers": []}, {"title_numbers": ["not a title"]},
+                               {"title_numbers": ["RTV100000"] * 501}]:
+            resp = self.app.post('/v1/titles/lookup', data=json.dumps(lookup_request),
+                                 headers={'accept': 'application/json', 'content-type': 'application/json'})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json['error_code'], "E001")
+
+    def test_011_bulk_update_titles(self):
+        """Updates many titles, reporting locked, missing and conflicting titles without failing the rest."""
+        owner = seller()
+        self.add_titles(4, owner)
+        other_owner = Owner("2", "David", "Jones", "david.jones@example.com", "07123456781", 'individual',
+                            Address("2", "Digital Street", "Bristol", "Avon", "England", "BS2 8EN"))
+        db.session.add(other_owner)
+        Title.query.get("RTV100001").lock = datetime(3000, 1, 1)
+        db.session.commit()
+        db.session.remove()
+
+        # A new owner whose email address belongs to someone else breaks the unique constraint
+        conflicting_owner = dict(owner_request, identity="3", email_address="david.jones@example.com")
+        bulk_request = {"titles": [
+            dict(title_request, title_number="RTV100000"),
+            dict(title_request, title_number="RTV100001"),
+            dict(title_request, title_number="RTV100002", owner=conflicting_owner),
+            dict(title_request, title_number="RTV100003"),
+            dict(title_request, title_number="RTV100009")
+        ]}
+        resp = self.app.put('/v1/titles', data=json.dumps(bulk_request), query_string={'chunk_size': 2},
+                            headers={'accept': 'application/json', 'content-type': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        db.session.remove()
+
+        self.assertEqual(resp.json["RTV100000"]["status"], 200)
+        self.assertEqual(resp.json["RTV100000"]["title"]["owner"]["last_name"], "Black")
+        self.assertEqual(resp.json["RTV100001"]["error_code"], "E403")
+        self.assertEqual(resp.json["RTV100002"]["error_code"], "E003")
+        self.assertEqual(resp.json["RTV100003"]["status"], 200)
+        self.assertEqual(resp.json["RTV100009"]["error_code"], "E404")
+
+        _, result = self.count_get('/v1/titles/RTV100003')
+        self.assertEqual(result, resp.json["RTV100003"]["title"])
+        _, result = self.count_get('/v1/titles/RTV100002')
+        self.assertEqual(result['owner']['identity'], "1")
+        self.assertEqual(len(result['restrictions']), 2)
+        self.assertIsNone(Owner.query.get("3"))
+
+    def test_012_bulk_update_titles_invalid(self):
+        """Rejects the whole batch if any title request is invalid."""
+        for bulk_request in [{"titles": []}, {"titles": [title_request]},
+                             {"titles": [dict(title_request, title_number="RTV100000", charges=None)]},
+                             {"titles": [dict(title_request, title_number="RTV100000")] * 2}]:
+            resp = self.app.put('/v1/titles', data=json.dumps(bulk_request),
+                                headers={'accept': 'application/json', 'content-type': 'application/json'})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json['error_code'], "E001")
+
+    def test_013_get_title_fields(self):
+        """Getting a subset of a title's fields only queries the relationships those fields need."""
+        owner = seller()
+        self.add_titles(1, owner)
+        _, expected = self.count_get('/v1/titles/RTV100000')
+
+        count, result = self.count_get('/v1/titles/RTV100000', {'fields': 'locked_at'})
+        self.assertEqual(result, {"title_number": "RTV100000", "locked_at": None})
+        self.assertEqual(count, 1)
+        self.assertNotIn('FROM restriction', self.statements[0])
+
+        count, result = self.count_get('/v1/titles/RTV100000', {'fields': 'owner,address'})
+        self.assertEqual(result, {key: expected[key] for key in ('title_number', 'owner', 'address')})
+        self.assertEqual(count, 1)
+
+        count, result = self.count_get('/v1/titles/RTV100000', {'fields': 'restriction_consenting_parties'})
+        self.assertEqual(result['restriction_consenting_parties'], expected['restriction_consenting_parties'])
+        self.assertEqual(count, 2)
+        self.assertFalse(any('FROM charge' in statement for statement in self.statements))
+
+    def test_014_get_titles_fields(self):
+        """Listing titles with fields returns and loads only those fields, paginated or streamed."""
+        owner = seller()
+        self.add_titles(3, owner)
+        query_string = {'owner_email_address': "lisa.seller@example.com", 'fields': 'price_history'}
+
+        count, results = self.count_get('/v1/titles', query_string)
+        self.assertEqual([sorted(result) for result in results], [['price_history', 'title_number']] * 3)
+        self.assertFalse(any('FROM restriction' in statement or 'FROM charge' in statement
+                             for statement in self.statements))
+        self.assertLessEqual(count, 3)
+
+        count, results = self.count_get('/v1/titles', dict(query_string, limit=2))
+        self.assertEqual(len(results), 2)
+        self.assertEqual(len(results[0]['price_history']), 2)
+
+        resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                            query_string=dict(query_string, stream='true'))
+        streamed = json.loads(resp.get_data(as_text=True))
+        self.assertEqual([sorted(result) for result in streamed], [['price_history', 'title_number']] * 3)
+
+    def test_015_get_title_invalid_fields(self):
+        """Rejects fields that are not part of a title."""
+        for url, query_string in [('/v1/titles/RTV100000', {}), ('/v1/titles', {'owner_identity': "1"})]:
+            for fields in ['lock', 'owner,', 'owner,document']:
+                resp = self.app.get(url, headers={'accept': 'application/json'},
+                                    query_string=dict(query_string, fields=fields))
+                self.assertEqual(resp.status_code, 400)
+                self.assertEqual(resp.json['error_code'], "E001")
+
+    def test_016_get_titles_single_query(self):
+        """Filters titles on their owner and address in the one query that fetches them."""
+        owner = seller()
+        self.add_titles(3, owner)
+
+        count, results = self.count_get('/v1/titles', {'owner_identity': "1", 'fields': 'owner,address'})
+        self.assertEqual([result['title_number'] for result in results], ["RTV100000", "RTV100001", "RTV100002"])
+        self.assertEqual(count, 1)
+
+        # The owner's address has the same house number and postcode, only the title's address is matched
+        count, results = self.count_get('/v1/titles', {'owner_email_address': "Lisa.Seller@example.com",
+                                                       'address_house_name_number': "1",
+                                                       'address_postcode': "BS2 8EN",
+                                                       'fields': 'address'})
+        self.assertEqual(results, [{"title_number": "RTV100001", "address": results[0]['address']}])
+        self.assertEqual(results[0]['address']['house_name_number'], "1")
+        self.assertEqual(count, 1)
+
+        count, results = self.count_get('/v1/titles', {'owner_identity': "2"})
+        self.assertEqual(results, [])
+        self.assertEqual(count, 1)
+
+    def title_request_from(self, document):
+        """Builds a title request that puts a title back as it is in its document."""
+        def without_nulls(item):
+            if isinstance(item, dict):
+                return {key: without_nulls(value) for key, value in item.items() if value is not None}
+            if isinstance(item, list):
+                return [without_nulls(value) for value in item]
+            return item
+        request = without_nulls({key: document[key] for key in ('owner', 'restrictions', 'charges')})
+        request['price_history'] = []
+        return request
+
+    def put_title(self, title_number, request):
+        """Puts the title request and returns the response and the statements that wrote to the database."""
+        self.statements = []
+        resp = self.app.put('/v1/titles/' + title_number, data=json.dumps(request),
+                            headers={'accept': 'application/json', 'content-type': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        db.session.remove()
+        return resp, [statement for statement in self.statements
+                      if statement.split(' ', 1)[0] in ('INSERT', 'UPDATE', 'DELETE')]
+
+    def test_017_update_title_unchanged_writes_nothing(self):
+        """Putting a title back as it was doesn't write anything."""
+        owner = seller()
+        self.add_titles(1, owner)
+        _, expected = self.count_get('/v1/titles/RTV100000')
+
+        request = self.title_request_from(expected)
+        resp, writes = self.put_title('RTV100000', request)
+        self.assertEqual(writes, [])
+        self.assertEqual(resp.json, expected)
+
+    def test_018_update_title_minimal_changes(self):
+        """Updating one of hundreds of restrictions and charges only deletes and inserts the ones that changed."""
+        owner = seller()
+        self.add_titles(1, owner)
+        title = Title.query.get("RTV100000")
+        for i in range(300):
+            title.restrictions.append(Restriction(None, "RTV", "ORES", "Restriction {}".format(i), consenting_party,
+                                                  "RTV100000"))
+            title.charges.append(Charge(None, lender, i, "GBP", "RTV100000"))
+        db.session.commit()
+        db.session.remove()
+        _, expected = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(len(expected['restrictions']), 302)
+        self.assertEqual(len(expected['charges']), 302)
+
+        request = self.title_request_from(expected)
+        changed_restriction = next(restriction for restriction in request['restrictions']
+                                   if 'charge' in restriction)
+        changed_restriction['restriction_text'] = "Changed text"
+        changed_restriction['charge']['amount'] = 12345
+        request['charges'][0]['amount'] = 54321
+        request['charges'].append(dict(request['charges'][1]))
+        resp, writes = self.put_title('RTV100000', request)
+
+        self.assertEqual(len([statement for statement in writes if statement.startswith('DELETE')]), 2)
+        # One batched INSERT per table, however many rows it adds
+        self.assertEqual(len([statement for statement in writes if statement.startswith('INSERT')]), 2)
+        self.assertEqual(len(resp.json['restrictions']), 302)
+        self.assertEqual(len(resp.json['charges']), 303)
+        self.assertEqual(sorted((restriction['restriction_text'], restriction.get('charge', {}).get('amount'))
+                                for restriction in self.title_request_from(resp.json)['restrictions']),
+                         sorted((restriction['restriction_text'], restriction.get('charge', {}).get('amount'))
+                                for restriction in request['restrictions']))
+        self.assertEqual(sorted(charge['amount'] for charge in resp.json['charges']),
+                         sorted(charge['amount'] for charge in request['charges']))
+
+        _, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(result, resp.json)
+
+    def test_019_lock_unlock_single_statement(self):
+        """Locking only succeeds while a title is unlocked, and updates its stored document without loading it."""
+        owner = seller()
+        self.add_titles(1, owner)
+        Title.query.get("RTV100000").build_document()
+        db.session.commit()
+        db.session.remove()
+
+        self.statements = []
+        resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(self.statements), 3)
+        self.assertFalse(any('FROM restriction' in statement for statement in self.statements))
+        db.session.remove()
+        self.assertEqual(resp.get_data(as_text=True), repr(Title.query.get("RTV100000")))
+        db.session.remove()
+
+        resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 409)
+
+        # An expired lock can be taken again
+        Title.query.get("RTV100000").lock = datetime(2000, 1, 1)
+        db.session.commit()
+        db.session.remove()
+        resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertGreater(resp.json['locked_at'], datetime.utcnow().isoformat())
+
+        resp = self.app.put('/v1/titles/RTV100000/unlock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.json['locked_at'])
+        db.session.remove()
+        self.assertEqual(resp.get_data(as_text=True), repr(Title.query.get("RTV100000")))
+        resp = self.app.put('/v1/titles/RTV100000/unlock', headers={'accept': 'application/json'})
+        self.assertEqual(resp.status_code, 409)
+
+        for url in ['/v1/titles/RTV999999/lock', '/v1/titles/RTV999999/unlock']:
+            resp = self.app.put(url, headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 404)
+
+    def test_020_update_title_if_match(self):
+        """The title's version is its ETag, and a PUT with a stale If-Match is refused without writing anything."""
+        owner = seller()
+        self.add_titles(1, owner)
+        resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+        etag = resp.headers['ETag']
+        self.assertEqual(etag, '"1"')
+        request = self.title_request_from(resp.json)
+        request['charges'].append(dict(request['charges'][0], amount=5))
+        headers = {'accept': 'application/json', 'content-type': 'application/json'}
+
+        resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request),
+                            headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(resp.status_code, 200)
+        new_etag = resp.headers['ETag']
+        self.assertNotEqual(new_etag, etag)
+        resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+        self.assertEqual(resp.headers['ETag'], new_etag)
+        db.session.remove()
+
+        # The version the client read is no longer current
+        self.statements = []
+        resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request),
+                            headers=dict(headers, **{'If-Match': etag}))
+        self.assertEqual(resp.status_code, 412)
+        self.assertEqual(resp.json['error_code'], 'E412')
+        self.assertFalse(any(statement.startswith(('INSERT', 'UPDATE', 'DELETE')) for statement in self.statements))
+        db.session.remove()
+
+        # Locking changes the title so changes its version too
+        resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+        self.assertNotEqual(resp.headers['ETag'], new_etag)
+        self.app.put('/v1/titles/RTV100000/unlock', headers={'accept': 'application/json'})
+        resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request),
+                            headers=dict(headers, **{'If-Match': '*'}))
+        self.assertEqual(resp.status_code, 200)
+
+    def test_021_update_title_concurrent_change(self):
+        """A PUT whose title is changed by another writer after it was read fails rather than overwriting it."""
+        owner = seller()
+        self.add_titles(1, owner)
+        resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+        request = self.title_request_from(resp.json)
+        request['owner']['phone_number'] = "07000000000"
+        db.session.remove()
+
+        # Another writer updates the title between this request reading it and writing it
+        def concurrent_update(conn, cursor, statement, parameters, context, executemany):
+            if statement.startswith('UPDATE title'):
+                cursor.execute("UPDATE title SET version = version + 1 WHERE title_number = 'RTV100000'")
+
+        headers = {'accept': 'application/json', 'content-type': 'application/json'}
+        event.listen(db.engine, 'before_cursor_execute', concurrent_update)
+        try:
+            resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request),
+                                headers=dict(headers, **{'If-Match': '"1"'}))
+            self.assertEqual(resp.status_code, 412)
+            db.session.remove()
+
+            resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request), headers=headers)
+            self.assertEqual(resp.status_code, 409)
+            db.session.remove()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', concurrent_update)
+        self.assertEqual(Title.query.get("RTV100000").owner.phone, "07123456780")
+
+    def test_022_update_title_price_history(self):
+        """Prices are upserted by date in batched statements, and those that are already stored aren't written."""
+        owner = seller()
+        self.add_titles(1, owner)
+        resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+        request = self.title_request_from(resp.json)
+        db.session.remove()
+
+        request['price_history'] = [
+            {"amount": 0, "currency_code": "GBP", "date": "2000-01-01T00:00:00+00:00"},
+            {"amount": 5000, "currency_code": "GBP", "date": "2001-01-01T00:00:00+00:00"}
+        ] + [{"amount": 2000 + year, "currency_code": "GBP", "date": "{}-06-01T00:00:00Z".format(year)}
+             for year in range(1990, 2000)] + [
+            {"amount": 1, "currency_code": "EUR", "date": "1990-06-01T00:00:00Z"}
+        ]
+        resp, writes = self.put_title('RTV100000', request)
+        price_writes = [statement for statement in writes if 'price_history' in statement]
+        self.assertEqual(len(price_writes), 2)
+        self.assertTrue(price_writes[0].startswith('INSERT'))
+        self.assertTrue(price_writes[1].startswith('UPDATE'))
+
+        prices = {price['date_iso']: (price['amount'], price['currency_code']) for price in resp.json['price_history']}
+        self.assertEqual(len(prices), 12)
+        self.assertEqual(prices['2000-01-01T00:00:00'], (0, 'GBP'))
+        self.assertEqual(prices['2001-01-01T00:00:00'], (5000, 'GBP'))
+        self.assertEqual(prices['1990-06-01T00:00:00'], (1, 'EUR'))
+        self.assertEqual(prices['1999-06-01T00:00:00'], (3999, 'GBP'))
+        self.assertEqual(PriceHistory.query.filter_by(title_number='RTV100000').count(), 12)
+
+        resp, writes = self.put_title('RTV100000', request)
+        self.assertEqual(writes, [])
+
+    def test_023_server_timing(self):
+        """With server timing on, title requests report the time spent in each phase in a header and the log."""
+        owner = seller()
+        self.add_titles(1, owner)
+
+        with mock.patch.object(server_timing, 'enabled', True), mock.patch.object(app.logger, 'info') as mock_info:
+            resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'},
+                                query_string={'fields': 'owner,restrictions'})
+            timings = dict(timing.split(';dur=') for timing in resp.headers['Server-Timing'].split(', '))
+            self.assertEqual(list(timings), ['sql', 'serialize', 'encode', 'total'])
+            self.assertTrue(all(float(duration) >= 0 for duration in timings.values()))
+            self.assertEqual(mock_info.call_args[0][0], "Timings of GET /v1/titles/RTV100000")
+            self.assertEqual(list(mock_info.call_args[1]['extra']['timings']), list(timings))
+
+            resp = self.app.post('/v1/titles/lookup', data=json.dumps({"title_numbers": ["RTV100000"]}),
+                                 headers={'accept': 'application/json', 'content-type': 'application/json'})
+            self.assertTrue(resp.headers['Server-Timing'].startswith('validation;dur='))
+
+            # Only the title, owner and conveyancer routes are timed
+            resp = self.app.get('/health')
+            self.assertNotIn('Server-Timing', resp.headers)
+
+        with mock.patch.object(server_timing, 'enabled', False):
+            resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn('Server-Timing', resp.headers)
+
+    def test_024_metrics(self):
+        """Requests, title lock outcomes, stored document lookups and pool checkouts are counted for /metrics."""
+        def sample(name, **labels):
+            # Read from /metrics, which adds up the counts of every process that has written to the metrics
+            # directory, so the counts from before this test are read the same way as those after it
+            for family in text_string_to_metric_families(self.app.get('/metrics').get_data(as_text=True)):
+                for metric in family.samples:
+                    if metric.name == name and metric.labels == labels:
+                        return metric.value
+            return 0
+
+        owner = seller()
+        self.add_titles(1, owner)
+        before = {
+            'ok': sample('title_api_title_locks_total', action='lock', outcome='ok'),
+            'conflict': sample('title_api_title_locks_total', action='lock', outcome='conflict'),
+            'not_found': sample('title_api_title_locks_total', action='unlock', outcome='not_found'),
+            'hit': sample('title_api_cache_lookups_total', cache='title_document', result='hit'),
+            'miss': sample('title_api_cache_lookups_total', cache='title_document', result='miss'),
+            'requests': sample('title_api_http_requests_total', blueprint='title_v1', method='PUT', status='409',
+                               route='/v1/titles/<string:title_number>/lock')
+        }
+
+        self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+        for url in ['/v1/titles/RTV100000/lock', '/v1/titles/RTV100000/lock', '/v1/titles/RTV999999/unlock']:
+            self.app.put(url, headers={'accept': 'application/json'})
+        self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+
+        self.assertEqual(sample('title_api_title_locks_total', action='lock', outcome='ok'), before['ok'] + 1)
+        self.assertEqual(sample('title_api_title_locks_total', action='lock', outcome='conflict'),
+                         before['conflict'] + 1)
+        self.assertEqual(sample('title_api_title_locks_total', action='unlock', outcome='not_found'),
+                         before['not_found'] + 1)
+        # The title's document was built when it was locked
+        self.assertEqual(sample('title_api_cache_lookups_total', cache='title_document', result='miss'),
+                         before['miss'] + 1)
+        self.assertEqual(sample('title_api_cache_lookups_total', cache='title_document', result='hit'),
+                         before['hit'] + 1)
+
+        self.assertEqual(sample('title_api_http_requests_total', blueprint='title_v1', method='PUT', status='409',
+                                route='/v1/titles/<string:title_number>/lock'), before['requests'] + 1)
+
+        # The pool counts its checkouts, and how many connections are in use. The gauges are this process's own.
+        engine = create_engine('sqlite://', poolclass=MeteredQueuePool, pool_size=1, max_overflow=1)
+        checkouts = sample('title_api_db_pool_checkouts_total')
+        with engine.connect(), engine.connect():
+            self.assertEqual(REGISTRY.get_sample_value('title_api_db_pool_checked_out'), 2)
+            self.assertEqual(REGISTRY.get_sample_value('title_api_db_pool_overflow'), 1)
+        self.assertEqual(REGISTRY.get_sample_value('title_api_db_pool_checked_out'), 0)
+        self.assertEqual(sample('title_api_db_pool_checkouts_total'), checkouts + 2)
+
+    def test_025_sql_statement_budgets(self):
+        """Requests over their route's SQL statement budget fail while budgets are strict, and are logged otherwise."""
+        owner = seller()
+        self.add_titles(1, owner)
+        labels = {'blueprint': 'title_v1', 'route': '/v1/titles/<string:title_number>', 'method': 'GET'}
+        requests = REGISTRY.get_sample_value('title_api_sql_statements_count', labels) or 0
+
+        # Serializing a title without a stored document takes more than one statement
+        budgets = dict(app.config['SQL_STATEMENT_BUDGETS'], **{'title_v1.get_title': 1})
+        with mock.patch.dict(app.config, {'SQL_STATEMENT_BUDGETS': budgets}), \
+                mock.patch.object(app.logger, 'exception') as mock_exception:
+            resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 500)
+            self.assertIn("title_v1.get_title ran more than its budget of 1 SQL statements",
+                          repr(mock_exception.call_args[0][1]))
+        db.session.remove()
+
+        with mock.patch.dict(app.config, {'SQL_STATEMENT_BUDGETS': budgets, 'SQL_STATEMENT_BUDGET_STRICT': False,
+                                          'SQL_SLOW_STATEMENT_SECONDS': 0}), \
+                mock.patch.object(app.logger, 'warning') as mock_warning:
+            resp = self.app.get('/v1/titles/RTV100000', headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 200)
+            warnings = [call[0][0] for call in mock_warning.call_args_list]
+            self.assertTrue(warnings[0].startswith("Slow SQL statement took "))
+            self.assertRegex(warnings[-1], r"^GET /v1/titles/RTV100000 ran \d+ SQL statements, over its budget of 1$")
+
+        self.assertEqual(REGISTRY.get_sample_value('title_api_sql_statements_count', labels), requests + 2)
+
+    def test_026_update_title_batched_inserts(self):
+        """Adding many restrictions and charges takes the same number of statements as adding one."""
+        owner = seller()
+        self.add_titles(1, owner)
+        _, expected = self.count_get('/v1/titles/RTV100000')
+
+        request = self.title_request_from(expected)
+        restriction = next(restriction for restriction in request['restrictions'] if 'charge' in restriction)
+        for i in range(30):
+            request['restrictions'].append(dict(restriction, restriction_text="New restriction {}".format(i),
+                                                charge=dict(restriction['charge'], amount=1000 + i)))
+            request['charges'].append(dict(request['charges'][0], amount=2000 + i))
+        resp, writes = self.put_title('RTV100000', request)
+        self.assertEqual(len(self.statements), 13)
+
+        inserts = [statement.split('(', 1)[0].strip() for statement in writes if statement.startswith('INSERT')]
+        self.assertEqual(inserts, ['INSERT INTO charge', 'INSERT INTO restriction'])
+        self.assertEqual(len(resp.json['restrictions']), 32)
+        self.assertEqual(len(resp.json['charges']), 32)
+        self.assertEqual(sorted((restriction['restriction_text'], restriction.get('charge', {}).get('amount'))
+                                for restriction in self.title_request_from(resp.json)['restrictions']),
+                         sorted((restriction['restriction_text'], restriction.get('charge', {}).get('amount'))
+                                for restriction in request['restrictions']))
+
+        _, result = self.count_get('/v1/titles/RTV100000')
+        self.assertEqual(result, resp.json)
+
+    def test_027_update_title_not_budgeted(self):
+        """Updating a title with many restrictions and charges, and an owner of many titles, isn't held to a budget."""
+        owner = seller()
+        self.add_titles(10, owner)
+        _, expected = self.count_get('/v1/titles/RTV100000')
+
+        request = self.title_request_from(expected)
+        request['owner']['phone_number'] = "07999999999"
+        restriction = next(restriction for restriction in request['restrictions'] if 'charge' in restriction)
+        request['restrictions'] = [dict(restriction, restriction_text="Restriction {}".format(i),
+                                        charge=dict(restriction['charge'], amount=1000 + i)) for i in range(40)]
+        request['charges'] = [dict(request['charges'][0], amount=2000 + i) for i in range(40)]
+        request['price_history'] = [{"amount": 1000 * i, "currency_code": "GBP",
+                                     "date": "20{:02d}-01-01T00:00:00".format(i)} for i in range(10)]
+
+        with mock.patch.object(app.logger, 'warning') as mock_warning:
+            resp, _ = self.put_title('RTV100000', request)
+            self.assertEqual(len(resp.json['restrictions']), 40)
+            # Each of the owner's titles has its document rebuilt with an UPDATE of its own
+            self.assertGreater(len(self.statements), 20)
+            self.assertFalse([call for call in mock_warning.call_args_list if 'budget' in call[0][0]])
+
+    def test_028_bulk_update_titles_unexpected_error(self):
+        """An unexpected error updating one title is reported for it, keeping the titles already committed."""
+        owner = seller()
+        self.add_titles(3, owner)
+        db.session.commit()
+        db.session.remove()
+
+        apply_title_request = title_v1.apply_title_request
+
+        def fail_second_chunk(title, title_request):
+            if title.title_number == "RTV100002":
+                raise RuntimeError("Unexpected failure")
+            return apply_title_request(title, title_request)
+
+        bulk_request = {"titles": [dict(title_request, title_number="RTV10000{}".format(i)) for i in range(3)]}
+        with mock.patch.object(title_v1, 'apply_title_request', side_effect=fail_second_chunk), \
+                mock.patch.object(app.logger, 'exception') as mock_exception:
+            resp = self.app.put('/v1/titles', data=json.dumps(bulk_request), query_string={'chunk_size': 2},
+                                headers={'accept': 'application/json', 'content-type': 'application/json'})
+        self.assertEqual(resp.status_code, 200)
+        db.session.remove()
+
+        self.assertEqual(resp.json["RTV100000"]["status"], 200)
+        self.assertEqual(resp.json["RTV100001"]["status"], 200)
+        self.assertEqual(resp.json["RTV100002"], {"status": 500, "error_code": "500",
+                                                  "error_message": "Internal Server Error"})
+        mock_exception.assert_called_once()
+
+        _, result = self.count_get('/v1/titles/RTV100001')
+        self.assertEqual(result['restrictions'], [])
+        _, result = self.count_get('/v1/titles/RTV100002')
+        self.assertEqual(len(result['restrictions']), 2)
+
+    def test_029_conditional_get_from_versions(self):
+        """Titles listed, or a subset of a title's fields, are revalidated from the titles' versions alone."""
+        owner = seller()
+        self.add_titles(2, owner)
+        db.session.commit()
+        db.session.remove()
+
+        def conditional_get(url, query_string, etag):
+            self.statements = []
+            resp = self.app.get(url, query_string=query_string,
+                                headers={'accept': 'application/json', 'If-None-Match': etag})
+            db.session.remove()
+            return resp
+
+        for url, query_string in [('/v1/titles', {'owner_identity': "1", 'limit': 2}),
+                                  ('/v1/titles', {'owner_identity': "1", 'fields': 'owner'}),
+                                  ('/v1/titles/RTV100000', {'fields': 'owner,restrictions'})]:
+            resp = self.app.get(url, headers={'accept': 'application/json'}, query_string=query_string)
+            etag = resp.headers['ETag']
+            db.session.remove()
+
+            resp = conditional_get(url, query_string, etag)
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.headers['ETag'], etag)
+            self.assertEqual(len(self.statements), 1)
+            self.assertFalse(any('FROM restriction' in statement or 'document' in statement
+                                 for statement in self.statements))
+
+            # Another set of fields is another representation
+            resp = conditional_get(url, dict(query_string, fields='address'), etag)
+            self.assertEqual(resp.status_code, 200)
+
+            # Changing a title changes its version
+            self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+            self.app.put('/v1/titles/RTV100000/unlock', headers={'accept': 'application/json'})
+            db.session.remove()
+            resp = conditional_get(url, query_string, etag)
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+        # Adding a title after the page gives it a next page
+        resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                            query_string={'owner_identity': "1", 'limit': 2})
+        etag = resp.headers['ETag']
+        self.assertNotIn('X-Next-Cursor', resp.headers)
+        db.session.remove()
+        self.add_titles(1, Owner.query.get("1"))
+        db.session.commit()
+        db.session.remove()
+        resp = conditional_get('/v1/titles', {'owner_identity': "1", 'limit': 2}, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('X-Next-Cursor', resp.headers)
+
+    def test_030_update_title_lock_database_clock(self):
+        """Updates go by the database's clock to decide whether a title is locked, as locking does."""
+        self.add_titles(1, seller())
+        db.session.commit()
+        _, expected = self.count_get('/v1/titles/RTV100000')
+        request = self.title_request_from(expected)
+        headers = {'accept': 'application/json', 'content-type': 'application/json'}
+
+        class SkewedClock(datetime):
+            skew = timedelta()
+
+            @classmethod
+            def utcnow(cls):
+                return datetime.utcnow() + cls.skew
+
+        with mock.patch.object(title_v1, 'datetime', SkewedClock):
+            # The app's clock is two hours ahead, but the lock has an hour left by the database's
+            SkewedClock.skew = timedelta(hours=2)
+            Title.query.get("RTV100000").lock = datetime.utcnow() + timedelta(hours=1)
+            db.session.commit()
+            db.session.remove()
+            resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request), headers=headers)
+            self.assertEqual(resp.status_code, 403)
+            self.assertEqual(resp.json['error_code'], "E403")
+            resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 409)
+            db.session.remove()
+
+            # The app's clock is two hours behind, but the lock expired an hour ago by the database's
+            SkewedClock.skew = timedelta(hours=-2)
+            Title.query.get("RTV100000").lock = datetime.utcnow() - timedelta(hours=1)
+            db.session.commit()
+            db.session.remove()
+            resp = self.app.put('/v1/titles/RTV100000', data=json.dumps(request), headers=headers)
+            self.assertEqual(resp.status_code, 200)
+            db.session.remove()
+            resp = self.app.put('/v1/titles/RTV100000/lock', headers={'accept': 'application/json'})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_031_get_titles_by_address_single_title(self):
+        """A title found by its address is returned on its own, whatever the limit, cursor and stream asked for."""
+        owner = seller()
+        self.add_titles(2, owner)
+        # A second title at house number 0
+        self.add_titles(1, owner)
+        db.session.commit()
+        db.session.remove()
+        query_string = {'owner_identity': "1", 'address_house_name_number': "0", 'address_postcode': "BS2 8EN",
+                        'fields': 'address'}
+
+        for extra in [{}, {'limit': 5}, {'limit': 1}, {'stream': 'true'}]:
+            resp = self.app.get('/v1/titles', headers={'accept': 'application/json'},
+                                query_string=dict(query_string, **extra))
+            self.assertEqual(resp.status_code, 200)
+            # Streamed responses have no ETag
+            self.assertIn('ETag', resp.headers)
+            self.assertNotIn('X-Next-Cursor', resp.headers)
+            self.assertEqual([result['title_number'] for result in resp.json], ["RTV100000"])
+            db.session.remove()
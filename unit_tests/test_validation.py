@@ -0,0 +1,103 @@
+from unittest import TestCase
+from jsonschema import FormatChecker, ValidationError, validate
+from title_api import validation
+from title_api.exceptions import ApplicationError
+import copy
+
+x500 = {"organisation": "Lender1", "locality": "Plymouth", "country": "GB"}
+charge = {"date": "2018-11-07T10:25:29+00:00", "lender": x500, "amount": 150000.5, "amount_currency_code": "GBP"}
+restriction = {"restriction_id": "RTV", "restriction_type": "CBCR", "restriction_text": "Restriction text",
+               "consenting_party": x500, "date": "2018-11-07T10:25:29+00:00", "charge": charge}
+title_request = {
+    "owner": {
+        "identity": "1",
+        "first_name": "Lisa",
+        "last_name": "White",
+        "email_address": "lisa.seller@example.com",
+        "phone_number": "07123456780",
+        "type": "individual",
+        "address": {"house_name_number": "1", "street": "Digital Street", "town_city": "Bristol", "county": "Avon",
+                    "country": "England", "postcode": "BS2 8EN"}
+    },
+    "charges": [charge],
+    "restrictions": [restriction, dict(restriction, restriction_type="ORES")],
+    "price_history": [{"amount": 100000, "currency_code": "GBP", "date": "2018-11-07T10:25:29+00:00"}]
+}
+
+
+def changed(document, path, value):
+    """Copy of the document with the value at the path replaced, or removed if the value is None."""
+    document = copy.deepcopy(document)
+    item = document
+    for key in path[:-1]:
+        item = item[key]
+    if value is None:
+        del item[path[-1]]
+    else:
+        item[path[-1]] = value
+    return document
+
+
+class TestValidation(TestCase):
+
+    def check_messages(self, name, instances):
+        """Checks each instance gives the same outcome and message as validating against openapi.json directly."""
+        schema = validation.openapi['components']['schemas'][name]
+        for instance in instances:
+            try:
+                validate(instance, schema, format_checker=FormatChecker(), resolver=validation.ref_resolver)
+            except ValidationError as e:
+                expected = e.message
+            else:
+                expected = None
+
+            try:
+                validation.validate_request(name, instance)
+            except ApplicationError as e:
+                self.assertEqual((e.message, e.code, e.http_code), (expected, "E001", 400))
+            else:
+                self.assertIsNone(expected)
+
+    def test_001_title_request(self):
+        """TitleRequest is validated with the same messages as before."""
+        self.check_messages('TitleRequest', [
+            title_request,
+            {},
+            changed(title_request, ['owner'], None),
+            changed(title_request, ['owner', 'identity'], 1),
+            changed(title_request, ['owner', 'type'], "person"),
+            changed(title_request, ['owner', 'email_address'], "not an email"),
+            changed(title_request, ['owner', 'address', 'postcode'], None),
+            changed(title_request, ['charges', 0, 'lender', 'country'], "GBR"),
+            changed(title_request, ['charges', 0, 'lender', 'extra'], "Field"),
+            changed(title_request, ['charges', 0, 'amount'], "150000"),
+            changed(title_request, ['restrictions', 0, 'restriction_type'], "XXXX"),
+            changed(title_request, ['restrictions', 1, 'consenting_party'], None),
+            changed(title_request, ['price_history', 0, 'amount'], 1.5),
+            changed(title_request, ['price_history', 0, 'currency_code'], "gbp")
+        ])
+        self.assertIsNone(validation.validate_request('TitleRequest', title_request))
+
+    def test_002_lookup_and_bulk_requests(self):
+        """TitleLookupRequest and TitleBulkRequest are validated with the same messages as before."""
+        self.check_messages('TitleLookupRequest', [
+            {"title_numbers": ["RTV100000"]},
+            {"title_numbers": []},
+            {"title_numbers": ["rtv100000"]},
+            {"title_numbers": ["RTV100000"] * 501},
+            {}
+        ])
+        bulk_title = dict(title_request, title_number="RTV100000")
+        self.check_messages('TitleBulkRequest', [
+            {"titles": [bulk_title]},
+            {"titles": []},
+            {"titles": [title_request]},
+            {"titles": [changed(bulk_title, ['title_number'], "RTV")]},
+            {"titles": [bulk_title, changed(bulk_title, ['owner', 'first_name'], None)]}
+        ])
+
+    def test_003_validators_compiled_once(self):
+        """Every request schema has a validator built at startup, with no $ref left to resolve."""
+        self.assertEqual(sorted(validation.validators), sorted(validation.request_schemas))
+        for validator in validation.validators.values():
+            self.assertNotIn('$ref', str(validator.schema))